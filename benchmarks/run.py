@@ -0,0 +1,97 @@
+#!/usr/bin/env python
+"""Report the time and peak memory of each stage of collating synthetic notebooks.
+
+Run from the repository root, for example::
+
+    python benchmarks/run.py --students 300 --questions 40 --output-size 20000
+
+Peak memory is measured with tracemalloc, which also slows down the stages
+that it measures; compare timings only between runs of this script.
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+import tracemalloc
+import warnings
+
+import nbformat
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import nbcollate as nbc  # noqa: E402
+from nbcollate.nbcollate import i_sections  # noqa: E402
+from synthetic import make_class  # noqa: E402
+
+
+class Stages(object):
+    """Measure a sequence of stages."""
+
+    def __init__(self):
+        self.results = []
+
+    def run(self, name, fn, *args, **kwargs):
+        tracemalloc.start()
+        start = time.perf_counter()
+        try:
+            value = fn(*args, **kwargs)
+            seconds = time.perf_counter() - start
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+        self.results.append({'stage': name, 'seconds': seconds, 'peak_bytes': peak})
+        return value
+
+
+def parse_notebooks(texts):
+    return [nbformat.reads(text, as_version=4) for text in texts]
+
+
+def run_benchmark(args):
+    assignment_nb, submission_nbs = make_class(
+        args.questions, args.students, seed=args.seed, edit_rate=args.edit_rate,
+        output_size=args.output_size, answer_variety=args.answer_variety)
+    texts = [nbformat.writes(nb) for nb in submission_nbs]
+    del submission_nbs
+
+    stages = Stages()
+    submission_nbs = stages.run('read', parse_notebooks, texts)
+    nb = stages.run('nbcollate', nbc.nbcollate, assignment_nb, submission_nbs,
+                    clear_outputs=args.clear_outputs)
+    stages.run('i_sections', lambda: list(i_sections(nb)))
+    stages.run('remove_duplicate_answers', nbc.remove_duplicate_answers, nb)
+    stages.run('sort_answers', nbc.sort_answers, nb)
+    stages.run('write', nbformat.writes, nb)
+    return stages.results
+
+
+def main(argv=sys.argv[1:]):
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--questions', type=int, default=20)
+    parser.add_argument('--students', type=int, default=100)
+    parser.add_argument('--output-size', type=int, default=0,
+                        help="bytes of image output per answer cell")
+    parser.add_argument('--edit-rate', type=float, default=0.05,
+                        help="probability that a student edits a prompt")
+    parser.add_argument('--answer-variety', type=int, default=4,
+                        help="distinct answers per question")
+    parser.add_argument('--clear-outputs', action='store_true')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--json', action='store_true', help="print JSON")
+    args = parser.parse_args(argv)
+    # Edited prompt cells keep the cell id of the assignment cell.
+    warnings.filterwarnings('ignore', message='Non-unique cell id')
+    results = run_benchmark(args)
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    for result in results:
+        print('{stage:<26}{seconds:>10.4f} s{peak_mb:>10.2f} MB'.format(
+            peak_mb=result['peak_bytes'] / 2**20, **result))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,71 @@
+#!/usr/bin/env python
+"""Report the time that the command line takes to start, and the modules it imports.
+
+Run from the repository root::
+
+    python benchmarks/startup.py
+
+Each command is run in a fresh interpreter, several times; the median wall
+time is reported, next to that of an interpreter that imports nothing.
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+COMMANDS = [
+    ('python', 'pass'),
+    ('import nbcollate', 'import nbcollate'),
+    ('nbcollate --version', "from nbcollate.cli import main; main(['--version'])"),
+    ('nbcollate (usage error)', "from nbcollate.cli import main; main([])"),
+]
+
+# Modules that the command line should import only when a collation needs them.
+DEFERRED_MODULES = ['nbformat', 'jsonschema', 'minimalkeys', 'asyncio', 'numpy']
+
+
+def run(code):
+    start = time.perf_counter()
+    subprocess.run([sys.executable, '-c', code], cwd=ROOT,
+                   stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    return time.perf_counter() - start
+
+
+def imported_modules(code):
+    """Return the names of the modules that ``code`` imports."""
+    code = '{}\nimport sys\nprint(" ".join(sys.modules))'.format(code)
+    out = subprocess.run([sys.executable, '-c', code], cwd=ROOT, check=True,
+                         stdout=subprocess.PIPE).stdout.decode()
+    return set(out.splitlines()[-1].split())
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--repeat', type=int, default=20)
+    parser.add_argument('--json', action='store_true', help="Print the results as JSON")
+    args = parser.parse_args()
+
+    results = []
+    for name, code in COMMANDS:
+        seconds = statistics.median(run(code) for _ in range(args.repeat))
+        results.append({'command': name, 'seconds': seconds})
+    version_code = COMMANDS[2][1]
+    deferred = sorted(set(DEFERRED_MODULES) & imported_modules(version_code))
+    if args.json:
+        print(json.dumps({'commands': results, 'eagerly_imported': deferred}, indent=2))
+        return
+    for result in results:
+        print('{:<28}{:>8.1f} ms'.format(result['command'], result['seconds'] * 1000))
+    if deferred:
+        print('nbcollate --version imports', ', '.join(deferred))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,82 @@
+"""Generate synthetic assignment and submission notebooks, for benchmarks."""
+
+import base64
+import random
+
+import nbformat
+from nbformat.v4 import new_code_cell, new_markdown_cell, new_notebook, new_output
+
+WORDS = ('list dict loop value index string print return function variable '
+         'sum count range zip sorted filter map key item total').split()
+
+
+def make_sentence(rng, n):
+    return ' '.join(rng.choice(WORDS) for _ in range(n))
+
+
+def make_assignment(n_questions=20, *, seed=0):
+    """Return an assignment notebook with ``n_questions`` prompts.
+
+    Each prompt is a header cell, a prompt cell, and an empty answer cell.
+    """
+    rng = random.Random(seed)
+    cells = [new_markdown_cell('# Synthetic Assignment\n\n' + make_sentence(rng, 12))]
+    for i in range(n_questions):
+        cells += [
+            new_markdown_cell('## Question {}\n\n{}.'.format(
+                i + 1, make_sentence(rng, 20))),
+            new_code_cell('# {}\n'.format(make_sentence(rng, 8))),
+            new_code_cell(''),
+        ]
+    return new_notebook(cells=cells)
+
+
+def make_output(rng, size):
+    """Return a display_data output with a PNG payload of about ``size`` bytes."""
+    n = size * 3 // 4
+    payload = rng.getrandbits(8 * n).to_bytes(n, 'little')
+    return new_output('display_data', data={
+        'image/png': base64.b64encode(payload).decode('ascii'),
+        'text/plain': '<Figure>',
+    })
+
+
+def make_submission(assignment_nb, *, seed=0, edit_rate=0.05, output_size=0,
+                    answer_variety=4, max_answer_cells=3):
+    """Return a submission notebook that answers ``assignment_nb``.
+
+    Args:
+        edit_rate (float): the probability that the student edits a prompt cell
+        output_size (int): the size of the image output on each answer cell
+        answer_variety (int): the number of distinct answers to each question,
+            across all the submissions. Smaller values produce more duplicates.
+        max_answer_cells (int): the maximum number of cells in an answer
+    """
+    rng = random.Random(seed)
+    cells = []
+    for i, cell in enumerate(assignment_nb.cells):
+        if cell.cell_type == 'code' and not cell.source.strip():
+            for j in range(rng.randint(0, max_answer_cells)):
+                answer_seed = i * 1000 + j * 100 + rng.randrange(answer_variety)
+                answer = random.Random(answer_seed)
+                source = '\n'.join(make_sentence(answer, 6)
+                                   for _ in range(answer.randint(1, 6)))
+                outputs = [make_output(rng, output_size)] if output_size else []
+                cells.append(new_code_cell(source, outputs=outputs))
+            continue
+        cell = nbformat.from_dict(cell)
+        if rng.random() < edit_rate:
+            cell.source += ' ' + rng.choice(WORDS)
+        cells.append(cell)
+    return new_notebook(cells=cells, metadata=assignment_nb.metadata)
+
+
+def make_class(n_questions=20, n_students=100, *, seed=0, **kwargs):
+    """Return an assignment notebook and a list of submission notebooks.
+
+    Keyword arguments are passed to :func:`make_submission`.
+    """
+    assignment_nb = make_assignment(n_questions, seed=seed)
+    submission_nbs = [make_submission(assignment_nb, seed=seed + i + 1, **kwargs)
+                      for i in range(n_students)]
+    return assignment_nb, submission_nbs
@@ -3,10 +3,45 @@
 __version__ = "0.3.1"
 __all__ = [
     'nbcollate',
+    'nbcollate_async',
+    'AssignmentIndex',
+    'NotebookCollator',
     'nb_clear_outputs',
     'remove_duplicate_answers',
     'sort_answers',
     'get_answer_tuples',
+    'SectionIndex',
+    'read_notebooks',
+    'AnswerCache',
+    'CollationStats',
+    'CompletionMatrix',
+    'notebook_delta',
+    'apply_delta',
 ]
 
+from .cache import AnswerCache
 from .nbcollate import *
+from .stats import CollationStats
+
+# These are imported on first use, since they import nbformat, asyncio, or
+# NumPy. This keeps the command line quick to start.
+_LAZY_EXPORTS = {
+    'nbcollate_async': '.aio',
+    'read_notebooks': '.reader',
+    'CompletionMatrix': '.report',
+    'notebook_delta': '.delta',
+    'apply_delta': '.delta',
+}
+
+
+def __getattr__(name):
+    if name not in _LAZY_EXPORTS:
+        raise AttributeError('module {!r} has no attribute {!r}'.format(__name__, name))
+    from importlib import import_module
+    module = import_module(_LAZY_EXPORTS[name], __name__)
+    value = globals()[name] = getattr(module, name)
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(_LAZY_EXPORTS))
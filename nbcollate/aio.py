@@ -0,0 +1,91 @@
+"""Collate notebooks from an asyncio event loop."""
+
+import asyncio
+import os
+from collections import deque
+
+from .nbcollate import NotebookCollator
+from .reader import read_notebook
+
+# The default number of worker threads of ThreadPoolExecutor
+_DEFAULT_CONCURRENCY = min(32, (os.cpu_count() or 1) + 4)
+
+
+def _extract_answers(extractor, answer_nb, outputs, validate):
+    """Read (if necessary) and diff one answer notebook. This runs in an executor."""
+    if isinstance(answer_nb, (str, bytes, os.PathLike)):
+        answer_nb = read_notebook(answer_nb, outputs=outputs, validate=validate)
+        if answer_nb is None:
+            return None
+    return extractor.extract(answer_nb)
+
+
+async def nbcollate_async(assignment_nb, answer_nbs, *, ids=None, labels=None,
+                          clear_outputs=False, copy_cells=True, similarity=None,
+                          validate=True, executor=None, concurrency=None, cache=None,
+                          stats=None):
+    """An asynchronous version of :func:`nbcollate`.
+
+    Answer notebooks are read and diffed in ``executor``, so the event loop
+    isn't blocked. ``answer_nbs`` is consumed as notebooks are started, and at
+    most ``concurrency`` notebooks are in flight at once, so an iterable that
+    produces notebooks (rather than paths) as it goes needn't be held in
+    memory as a whole. Answers are added in the order of ``answer_nbs``, and
+    the result is the same notebook that :func:`nbcollate` returns. If the
+    coroutine is cancelled, notebooks that haven't been started are skipped.
+
+    Args:
+        answer_nbs: as for :func:`nbcollate`, except that an element can also
+            be a notebook pathname. A file that isn't a notebook is skipped.
+        validate (bool): if false, notebooks that are read from files aren't
+            validated; see :func:`parse_notebook`.
+        executor (Executor): the executor that reads and diffs the answer
+            notebooks. This defaults to the event loop's default executor.
+            With a :class:`~concurrent.futures.ProcessPoolExecutor`, the
+            assignment index and each answer notebook are pickled to the
+            worker, so prefer passing paths.
+        concurrency (int): the maximum number of notebooks that are read or
+            diffed at once. This defaults to the number of worker threads of
+            the default executor.
+
+    The other arguments are as for :func:`nbcollate`. ``stats`` doesn't record
+    the ``diff`` stage, which runs in the executor.
+
+    Returns:
+        Notebook: the collated notebook
+    """
+    if isinstance(answer_nbs, dict):
+        assert not ids
+        ids = list(answer_nbs.keys())
+        answer_nbs = answer_nbs.values()
+    collator = NotebookCollator(assignment_nb, clear_outputs=clear_outputs,
+                                copy_cells=copy_cells, similarity=similarity,
+                                cache=cache, stats=stats)
+    # The extractor has no answers or stats, so that it's cheap to pickle.
+    extractor = NotebookCollator(collator.index, clear_outputs=clear_outputs,
+                                 cache=cache)
+    loop = asyncio.get_running_loop()
+    concurrency = concurrency or _DEFAULT_CONCURRENCY
+    # (index, future) of the notebooks in flight, in the order of answer_nbs
+    pending = deque()
+
+    async def add_next():
+        i, future = pending.popleft()
+        answers = await future
+        if answers is not None:
+            collator.add_answers(ids[i] if ids else None, answers,
+                                 label=labels[i] if labels else None)
+
+    try:
+        for i, answer_nb in enumerate(answer_nbs):
+            if len(pending) >= concurrency:
+                await add_next()
+            pending.append((i, loop.run_in_executor(
+                executor, _extract_answers, extractor, answer_nb, not clear_outputs,
+                validate)))
+        while pending:
+            await add_next()
+    finally:
+        for _, future in pending:
+            future.cancel()
+    return collator.finish()
@@ -0,0 +1,121 @@
+"""Read submission notebooks from zip and tar archives, without extracting them.
+
+A notebook in an archive is named by the archive path joined with the member
+name, such as ``submissions.zip/alice/day1.ipynb``. Such a name can be used
+wherever a notebook path can: it's read from the archive, and submission
+labels are derived from it as from a file path.
+"""
+
+import io
+import mmap
+import os
+import posixpath
+import threading
+
+ARCHIVE_EXTENSIONS = ('.zip', '.tar', '.tar.gz', '.tgz', '.tar.bz2', '.tbz2', '.tar.xz',
+                      '.txz')
+
+
+class _MappedFile(mmap.mmap):
+    """A read-only memory map of a file, that zipfile accepts as a file object."""
+
+    def seekable(self):
+        return True
+
+
+# archive path -> ((mtime, size), archive, {member name: member info})
+_archives = {}
+# TarFile reads share a file position; ZipFile reads lock internally.
+_tar_lock = threading.Lock()
+
+
+def is_archive(path):
+    """Return true if ``path`` is a zip or tar file."""
+    return path.lower().endswith(ARCHIVE_EXTENSIONS) and os.path.isfile(path)
+
+
+def split_archive_path(path):
+    """Split a notebook path into the archive path and the member name.
+
+    Returns:
+        (str, str): the archive path and the member name, or ``(path, None)``
+        if ``path`` isn't inside an archive.
+    """
+    normalized = path.replace(os.sep, '/')
+    lower = normalized.lower()
+    for ext in ARCHIVE_EXTENSIONS:
+        i = lower.find(ext + '/')
+        while i >= 0:
+            end = i + len(ext)
+            if os.path.isfile(path[:end]):
+                return path[:end], normalized[end + 1:]
+            i = lower.find(ext + '/', end)
+    return path, None
+
+
+def _is_zip(path):
+    return path.lower().endswith('.zip')
+
+
+def _open_archive(path):
+    # These are imported here, since most collations don't read archives.
+    import tarfile
+    import zipfile
+
+    stat = os.stat(path)
+    signature = (stat.st_mtime_ns, stat.st_size)
+    entry = _archives.get(path)
+    if entry is None or entry[0] != signature:
+        with open(path, 'rb') as f:
+            # An empty file can't be mapped.
+            fileobj = (_MappedFile(f.fileno(), 0, access=mmap.ACCESS_READ)
+                       if stat.st_size else io.BytesIO())
+        if _is_zip(path):
+            archive = zipfile.ZipFile(fileobj)
+            members = {info.filename: info
+                       for info in archive.infolist() if not info.is_dir()}
+        else:
+            archive = tarfile.open(fileobj=fileobj)
+            members = {info.name: info
+                       for info in archive.getmembers() if info.isfile()}
+        entry = _archives[path] = (signature, archive, members)
+    return entry[1:]
+
+
+def _is_notebook_name(name):
+    # Skip the resource forks that the macOS archiver adds.
+    return (name.endswith('.ipynb') and not posixpath.basename(name).startswith('._')
+            and not name.startswith('__MACOSX/'))
+
+
+def archive_notebooks(path):
+    """Return the paths of the notebooks in the archive at ``path``, sorted."""
+    _, members = _open_archive(path)
+    return sorted(path + '/' + name for name in members if _is_notebook_name(name))
+
+
+def read_bytes(path):
+    """Return the contents of a file, or of a notebook in an archive."""
+    archive_path, name = split_archive_path(path)
+    if name is None:
+        with open(path, 'rb') as f:
+            return f.read()
+    archive, members = _open_archive(archive_path)
+    if name not in members:
+        raise FileNotFoundError(path)
+    if _is_zip(archive_path):
+        return archive.read(members[name])
+    with _tar_lock:
+        return archive.extractfile(members[name]).read()
+
+
+def file_size(path):
+    """Return the size of a file, or of a notebook in an archive."""
+    archive_path, name = split_archive_path(path)
+    if name is None:
+        return os.path.getsize(path)
+    _, members = _open_archive(archive_path)
+    if name not in members:
+        raise FileNotFoundError(path)
+    info = members[name]
+    return info.file_size if _is_zip(archive_path) else info.size
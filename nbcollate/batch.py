@@ -0,0 +1,141 @@
+"""Collate several assignments, listed in a manifest file, in parallel."""
+
+import argparse
+import glob
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from .cli import collate, collated_path, expand_paths, write_stats
+
+
+def read_manifest(manifest_path, args):
+    """Read a batch manifest.
+
+    A manifest is a JSON or TOML file with a list of assignments. In JSON::
+
+        {"assignments": [
+            {"assignment": "day1.ipynb",
+             "submissions": "submissions/day1/*.ipynb",
+             "output": "collated/day1-collated.ipynb",
+             "label": true}
+        ]}
+
+    ``submissions`` is a glob pattern, a directory, or a list of these.
+    ``output`` and ``label`` are optional; they default to the command-line
+    options. Relative paths are relative to the manifest's directory.
+
+    Returns:
+        [dict]: the assignments, with absolute paths, and with ``submissions``
+        expanded to a list of files.
+
+    Raises:
+        ValueError: if the manifest can't be parsed, or lacks a required field.
+    """
+    if manifest_path.endswith('.toml'):
+        try:
+            import tomllib
+        except ImportError:
+            raise ValueError('reading a TOML manifest requires Python 3.11 or later')
+        with open(manifest_path, 'rb') as f:
+            manifest = tomllib.load(f)
+    else:
+        with open(manifest_path) as f:
+            manifest = json.load(f)
+    if not (isinstance(manifest, dict)
+            and isinstance(manifest.get('assignments'), list)):
+        raise ValueError('expected a list of assignments, named "assignments"')
+    base_dir = os.path.dirname(os.path.abspath(manifest_path))
+    entries = []
+    for n, item in enumerate(manifest['assignments'], 1):
+        if not (isinstance(item, dict) and 'assignment' in item
+                and 'submissions' in item):
+            raise ValueError('assignment {} needs the fields "assignment" and '
+                             '"submissions"'.format(n))
+        assignment = os.path.join(base_dir, item['assignment'])
+        output = os.path.join(base_dir, item['output']) if 'output' in item else \
+            collated_path(assignment, args)
+        patterns = item['submissions']
+        if isinstance(patterns, str):
+            patterns = [patterns]
+        submissions = [path
+                       for pattern in patterns
+                       for path in sorted(glob.glob(os.path.join(base_dir, pattern)))]
+        entries.append({
+            'assignment': assignment,
+            'submissions': expand_paths(submissions, exclude=[assignment, output]),
+            'output': output,
+            'label': item.get('label', args.label),
+        })
+    return entries
+
+
+def collate_entry(entry, args):
+    """Collate one manifest entry. This runs in a worker process.
+
+    Returns:
+        dict: a report of the result.
+    """
+    # Each assignment is collated in a single worker, so that the pool
+    # isn't oversubscribed.
+    args = argparse.Namespace(**dict(vars(args), jobs=1, label=entry['label']))
+    result = {
+        'assignment': entry['assignment'],
+        'output': entry['output'],
+        'submissions': len(entry['submissions']),
+    }
+    if args.report:
+        # Each assignment's report is written next to its output, with the
+        # extension of the --report file.
+        args.report = result['report'] = '{}-report{}'.format(
+            os.path.splitext(entry['output'])[0], os.path.splitext(args.report)[1])
+    if args.delta:
+        args.delta = result['delta'] = '{}-delta{}'.format(
+            os.path.splitext(entry['output'])[0], os.path.splitext(args.delta)[1])
+    start = time.perf_counter()
+    try:
+        stats = collate(entry['assignment'], entry['submissions'], args,
+                        collated_nb_path=entry['output'])
+    except FileExistsError:
+        result['error'] = ('output file already exists; '
+                           'repeat with --force to replace it')
+    except Exception as e:
+        result['error'] = '{}: {}'.format(type(e).__name__, e)
+    else:
+        if args.stats:
+            result['stats'] = stats.as_dict()
+    result['seconds'] = time.perf_counter() - start
+    return result
+
+
+def run_batch(manifest_path, args):
+    """Collate the assignments in a manifest, using a pool of ``args.jobs`` processes.
+
+    Prints a line for each assignment as it completes. If ``args.stats`` is
+    set, writes the per-assignment results to it as JSON.
+
+    Returns:
+        bool: true if every assignment was collated.
+    """
+    try:
+        entries = read_manifest(manifest_path, args)
+    except (OSError, ValueError) as e:
+        sys.stderr.write('{}: {}\n'.format(manifest_path, e))
+        return False
+    jobs = min(args.jobs or os.cpu_count() or 1, len(entries)) or 1
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        futures = [executor.submit(collate_entry, entry, args) for entry in entries]
+        results = []
+        for future in futures:
+            result = future.result()
+            results.append(result)
+            if 'error' in result:
+                sys.stderr.write('{assignment}: {error}\n'.format(**result))
+            else:
+                print('{assignment}: {submissions} submissions in {seconds:.2f}s'
+                      .format(**result))
+    if args.stats:
+        write_stats(results, args.stats)
+    return not any('error' in result for result in results)
@@ -0,0 +1,100 @@
+"""An on-disk cache of the answers extracted from answer notebooks."""
+
+import hashlib
+import json
+import os
+
+from . import __version__
+
+
+def digest(data):
+    """Return a hex digest of ``data``, a :class:`bytes` or JSON-serializable value."""
+    if not isinstance(data, bytes):
+        data = json.dumps(data, sort_keys=True).encode()
+    return hashlib.sha256(data).hexdigest()
+
+
+class AnswerCache(object):
+    """A directory of JSON values, keyed by content digests.
+
+    Keys incorporate the nbcollate version, so entries written by a different
+    version are never read. When the files in the directory exceed
+    ``max_size`` bytes, the least recently used entries are removed.
+
+    Args:
+        directory (str): the cache directory. It is created if necessary.
+        max_size (int): the maximum total size of the entries, in bytes.
+    """
+
+    def __init__(self, directory, *, max_size=256 * 1024 * 1024):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.max_size = max_size
+        self._size = None
+
+    @staticmethod
+    def key(*parts):
+        """Return a cache key for a sequence of digests and other strings."""
+        return digest([__version__] + list(parts))
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + '.json')
+
+    def __contains__(self, key):
+        return os.path.exists(self._path(key))
+
+    def get(self, key, default=None):
+        """Return the value stored under ``key``, or ``default``."""
+        path = self._path(key)
+        try:
+            with open(path) as f:
+                value = json.load(f)
+            # The modification time records the last use, for eviction.
+            os.utime(path)
+        except (OSError, ValueError):
+            return default
+        return value
+
+    def put(self, key, value):
+        """Store ``value`` under ``key``, and evict entries if the cache is full."""
+        import tempfile
+
+        path = self._path(key)
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        with os.fdopen(fd, 'w') as f:
+            json.dump(value, f)
+        size = os.path.getsize(tmp_path)
+        if self._size is not None and os.path.exists(path):
+            self._size -= os.path.getsize(path)
+        os.replace(tmp_path, path)
+        if self._size is None:
+            self._size = sum(size for _, size, _ in self._entries())
+        else:
+            self._size += size
+        if self._size > self.max_size:
+            self.evict()
+
+    def _entries(self):
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith('.json'):
+                # Another process that shares the directory may have evicted
+                # or replaced the entry since the directory was listed.
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                yield stat.st_mtime, stat.st_size, entry.path
+
+    def evict(self):
+        """Remove the least recently used entries, until the cache fits in ``max_size``.
+        """
+        entries = sorted(self._entries())
+        self._size = sum(size for _, size, _ in entries)
+        for _, size, path in entries:
+            if self._size <= self.max_size:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            self._size -= size
@@ -1,30 +1,21 @@
 #!/usr/bin/env python
 """Create a combined notebook. The first path is the assignment notebook.
-Remaining paths are student notebooks.
+Remaining paths are student notebooks, directories, or zip or tar archives
+of them.
 """
 
 import argparse
-import logging
+import json
 import os
+import re
 import sys
 
-import nbformat
-import nbformat.reader
-
 import nbcollate as nbc
-from minimalkeys import minimal_keys
-
-from . import nbcollate
 
-
-def safe_read(nbf):
-    """A wrapper for nbformat.read, that prints a warning and returns None on
-    bad notebooks.
-    """
-    try:
-        return nbformat.read(nbf, as_version=4)
-    except nbformat.reader.NotJSONError:
-        print('while reading', nbf)
+from .archive import (archive_notebooks, file_size, is_archive, read_bytes,
+                      split_archive_path)
+from .cache import AnswerCache, digest
+from .stats import NULL_STATS, CollationStats
 
 
 def capitalize(s):
@@ -38,7 +29,278 @@ def map_if_uniq(fn, seq):
     return out if len(set(out)) == len(set(seq)) else seq
 
 
-def collate(master_nb_path, submission_paths, args):
+def iter_answers(collator, paths, *, jobs=1, cache=None, validate=True):
+    """Generate the answers that ``collator`` extracts from each notebook in ``paths``.
+
+    Generates None for a file that isn't a notebook. If ``cache`` is supplied,
+    answers are stored there, keyed by the file contents; a file whose answers
+    are in the cache isn't parsed. If the collator clears outputs, they're
+    discarded as the files are read. See :func:`parse_notebook` for ``validate``;
+    answers that are read without validation are cached separately.
+    """
+    import nbformat
+
+    from .reader import iter_notebooks, safe_read
+
+    stats = collator.stats
+    outputs = not collator.clear_outputs
+    if cache is None:
+        nbs = iter_notebooks(paths, jobs=jobs, outputs=outputs, validate=validate)
+        for nb in stats.iter_stage('read', nbs):
+            yield collator.extract(nb) if nb else None
+        return
+    keys = []
+    for path in paths:
+        try:
+            data = read_bytes(path)
+        except OSError:
+            # The file is read again in turn, so that the error is raised
+            # when its answers are reached.
+            keys.append(None)
+            continue
+        keys.append(cache.key('answers', collator.index.digest, digest(data),
+                              'outputs' if outputs else 'no-outputs',
+                              'validated' if validate else 'unvalidated'))
+    hits = [key is not None and key in cache for key in keys]
+    misses = stats.iter_stage('read', iter_notebooks(
+        [path for path, hit in zip(paths, hits) if not hit],
+        jobs=jobs, outputs=outputs, validate=validate))
+    for path, key, hit in zip(paths, keys, hits):
+        with stats.stage('read'):
+            answers = cache.get(key) if hit else None
+        if answers is not None:
+            stats.count('cache_hits')
+            yield [(k, [nbformat.from_dict(c) for c in cells]) for k, cells in answers]
+            continue
+        # An entry can be evicted between the membership test and the read.
+        if hit:
+            with stats.stage('read'):
+                nb = safe_read(path, outputs=outputs, validate=validate)
+        else:
+            nb = next(misses)
+        if not nb:
+            yield None
+            continue
+        answers = collator.extract(nb)
+        if key is not None:
+            cache.put(key, answers)
+        yield answers
+
+
+def submission_labels(paths):
+    """Return a label for each submission path, derived from the file names.
+
+    Labels for notebooks in archives are derived from their member names,
+    unless these are ambiguous.
+    """
+    from minimalkeys import minimal_keys
+
+    names = [split_archive_path(path)[1] or path for path in paths]
+    if len(set(names)) == len(set(paths)):
+        paths = names
+    if len(paths) < 2:
+        # minimal_keys reports a single path as a duplicate
+        labels = [os.path.splitext(os.path.basename(path))[0] for path in paths]
+    else:
+        labels = minimal_keys(paths, split=r'([\w-]+)')
+    labels = map_if_uniq(lambda s: s.replace('-', ' '), labels)
+    return map_if_uniq(capitalize, labels)
+
+
+def expand_paths(paths, exclude=()):
+    """Replace each directory in ``paths`` by the notebook files that it contains,
+    and each zip or tar archive by the paths of the notebooks inside it.
+
+    Paths in ``exclude`` are omitted.
+    """
+    out = []
+    for path in paths:
+        if os.path.isdir(path):
+            out += sorted(os.path.join(path, name) for name in os.listdir(path)
+                          if name.endswith('.ipynb'))
+        elif is_archive(path):
+            out += archive_notebooks(path)
+        else:
+            out.append(path)
+    exclude = {os.path.abspath(path) for path in exclude}
+    return [path for path in out if os.path.abspath(path) not in exclude]
+
+
+def collated_path(master_nb_path, args):
+    """Return the output pathname for the collation of ``master_nb_path``."""
+    suffix = "-collated"
+    root, ext = os.path.splitext(master_nb_path)
+    collated_nb_path = "{}{}{}".format(root, suffix, ext)
+    if args.out:
+        collated_nb_path = os.path.join(
+            args.out, os.path.split(collated_nb_path)[1])
+    return collated_nb_path
+
+
+def write_collated(collated_nb, collated_nb_path, args, *, overwrite=False,
+                   outputs=None, stats=NULL_STATS):
+    """Write a collated notebook, unless it exists and ``args.force`` isn't set.
+
+    If ``outputs`` (an :class:`OutputStore`) is supplied, image outputs are
+    written there instead of into the notebook.
+    """
+    if not (args.force or overwrite) and os.path.exists(collated_nb_path):
+        # FIXME raise condition; instead open w/ os.O_CREAT | os.O_WRONLY
+        err = FileExistsError()
+        err.filename = collated_nb_path
+        raise err
+    import nbformat
+
+    if outputs is not None:
+        with stats.stage('outputs'):
+            outputs.externalize(collated_nb, collated_nb_path, stats=stats)
+    if not args.dry_run:
+        with stats.stage('write'):
+            with open(collated_nb_path, 'w') as f:
+                nbformat.write(collated_nb, f)
+        stats.count('bytes_written', os.path.getsize(collated_nb_path))
+    print('wrote', collated_nb_path)
+
+
+def write_delta(collated_nb, collated_nb_path, delta_path, args, *, outputs=None,
+                stats=NULL_STATS):
+    """Write the changes since the previous collated notebook as a patch.
+
+    The patch, from :func:`nbcollate.delta.notebook_delta`, is written to
+    ``delta_path``. The collated notebook at ``collated_nb_path`` is the base
+    of the patch; it's rewritten only if it changed. If it doesn't exist, the
+    patch applies to a notebook with no cells.
+    """
+    import nbformat
+    from .delta import is_empty_delta, make_cell_ids_unique, notebook_delta
+
+    make_cell_ids_unique(collated_nb)
+    if outputs is not None:
+        with stats.stage('outputs'):
+            outputs.externalize(collated_nb, collated_nb_path, stats=stats)
+    old_nb = None
+    if os.path.exists(collated_nb_path):
+        with stats.stage('read'):
+            old_nb = nbformat.read(collated_nb_path, as_version=nbformat.NO_CONVERT)
+    with stats.stage('delta'):
+        delta = notebook_delta(old_nb, collated_nb)
+    stats.count('cells_changed', sum(len(cells) for _, _, cells in delta['cells']))
+    if not args.dry_run:
+        with stats.stage('write'):
+            with open(delta_path, 'w') as f:
+                json.dump(delta, f)
+        stats.count('bytes_written', os.path.getsize(delta_path))
+    print('wrote', delta_path)
+    if is_empty_delta(delta):
+        print('unchanged', collated_nb_path)
+        return
+    write_collated(collated_nb, collated_nb_path, args, overwrite=True, stats=stats)
+
+
+def apply_delta_file(delta_path, nb_path):
+    """Apply the patch at ``delta_path`` to the notebook at ``nb_path``, in place."""
+    import nbformat
+    from .delta import apply_delta
+
+    with open(delta_path) as f:
+        delta = json.load(f)
+    nb = nbformat.read(nb_path, as_version=nbformat.NO_CONVERT)
+    apply_delta(nb, delta)
+    with open(nb_path, 'w') as f:
+        nbformat.write(nb, f)
+    print('updated', nb_path)
+
+
+def section_filename(n, title):
+    """Return the file name of the notebook for section ``n``, titled ``title``."""
+    slug = re.sub(r'\W+', '-', title.lower()).strip('-')
+    return '{:02d}-{}.ipynb'.format(n, slug) if slug else '{:02d}.ipynb'.format(n)
+
+
+def section_files(sections_dir):
+    """Return the paths of the section notebooks in ``sections_dir``, that an
+    earlier :func:`write_sections` wrote."""
+    if not os.path.isdir(sections_dir):
+        return []
+    names = sorted(os.listdir(sections_dir))
+    return [os.path.join(sections_dir, name) for name in names
+            if re.match(r'\d{2,}(-[\w-]+)?\.ipynb$', name)]
+
+
+def write_sections(collator, collated_nb_path, args, *, overwrite=False, outputs=None,
+                   stats=NULL_STATS):
+    """Write a collated notebook as a notebook per section, and an index notebook.
+
+    The section notebooks are written to a directory named after
+    ``collated_nb_path``, as each section is assembled, so the collated
+    notebook is never held in memory as a whole. The index notebook, at
+    ``collated_nb_path``, holds the cells before the first section, and links
+    to the section notebooks.
+
+    Unless ``args.force`` or ``overwrite`` is set, nothing is written if the
+    index notebook or any section notebook exists. Section notebooks that an
+    earlier collation wrote, and that this one doesn't replace, are removed.
+    """
+    import nbformat
+
+    index_dir = os.path.dirname(collated_nb_path)
+    sections_dir = os.path.splitext(collated_nb_path)[0]
+    previous_paths = section_files(sections_dir)
+    if not (args.force or overwrite):
+        for path in [collated_nb_path] + previous_paths:
+            if os.path.exists(path):
+                err = FileExistsError()
+                err.filename = path
+                raise err
+    if not args.dry_run:
+        os.makedirs(sections_dir, exist_ok=True)
+    index_nb = collator.index.nb.copy()
+    index_nb.cells = []
+    links = []
+    paths = set()
+    sections = stats.iter_stage('assemble', collator.iter_sections())
+    for n, (title, cells) in enumerate(sections):
+        stats.count('cells_output', len(cells))
+        nb = collator.index.nb.copy()
+        nb.cells = cells
+        if not args.label:
+            index = nbc.SectionIndex(nb)
+            with stats.stage('dedup'):
+                nbc.remove_duplicate_answers(nb, sections=index)
+            if args.cluster_answers is not None:
+                with stats.stage('cluster'):
+                    nbc.sort_answers(nb, similarity=args.cluster_answers,
+                                     sections=index)
+        if title is None:
+            index_nb.cells = nb.cells
+            continue
+        path = os.path.join(sections_dir, section_filename(n, title))
+        write_collated(nb, path, args, overwrite=True, outputs=outputs, stats=stats)
+        paths.add(path)
+        links.append('- [{}]({})'.format(
+            title, os.path.relpath(path, index_dir).replace(os.sep, '/')))
+    if links:
+        index_nb.cells.append(nbformat.v4.new_markdown_cell('\n'.join(links)))
+    write_collated(index_nb, collated_nb_path, args, overwrite=True, outputs=outputs,
+                   stats=stats)
+    for path in previous_paths:
+        if path not in paths:
+            if not args.dry_run:
+                os.remove(path)
+            print('removed', path)
+
+
+def write_stats(data, path):
+    """Write collation statistics as JSON to ``path``, or to stderr if it's ``-``."""
+    text = json.dumps(data, indent=2) + '\n'
+    if path == '-':
+        sys.stderr.write(text)
+        return
+    with open(path, 'w') as f:
+        f.write(text)
+
+
+def collate(master_nb_path, submission_paths, args, collated_nb_path=None):
     """Collate notebooks.
 
     Arguments
@@ -47,67 +309,253 @@ def collate(master_nb_path, submission_paths, args):
         The master notebook.
     submission_paths: [str]
         A list of notebook file pathnames.
+    collated_nb_path: str
+        The output pathname. This defaults to a path derived from
+        ``master_nb_path``.
+
+    Returns
+    -------
+        CollationStats: the statistics, if ``args.stats`` is set.
     """
+    from .reader import safe_read
+
     if args.verbose:
+        import logging
         logging.basicConfig(format='%(message)s', level=logging.INFO)
-    submission_nbs = [safe_read(nbf) for nbf in submission_paths]
-    submission_nbs = [collated_nb for collated_nb in submission_nbs if collated_nb]
-    master_nb = safe_read(master_nb_path)
+    stats = CollationStats() if args.stats else NULL_STATS
+    with stats.stage('read'):
+        master_nb = safe_read(master_nb_path)
     assert master_nb
-    labels = None
+    stats.count('bytes_read',
+                sum(map(file_size, [master_nb_path] + list(submission_paths))))
+    labels = [None] * len(submission_paths)
     if args.label:
-        labels = minimal_keys(submission_paths, split=r'([\w-]+)')
-        labels = map_if_uniq(lambda s: s.replace('-', ' '), labels)
-        labels = map_if_uniq(capitalize, labels)
+        labels = submission_labels(submission_paths)
+    # A delta identifies answer cells by their submission. Paths are used,
+    # rather than labels, since these don't change when submissions are added.
+    ids = list(submission_paths) if args.delta else [None] * len(submission_paths)
+
+    # Add each submission as it's read, so that only its answers are retained.
+    collator = nbc.NotebookCollator(master_nb, clear_outputs=args.clear_outputs,
+                                    similarity=args.similarity, stats=stats)
+    cache = AnswerCache(args.cache) if args.cache else None
+    submission_answers = iter_answers(collator, submission_paths, jobs=args.jobs,
+                                      cache=cache, validate=not args.trust_inputs)
+    added_paths = []
+    for path, id, label, answers in zip(submission_paths, ids, labels,
+                                        submission_answers):
+        if answers is not None:
+            collator.add_answers(id, answers, label=label)
+            added_paths.append(path)
+    collated_nb_path = collated_nb_path or collated_path(master_nb_path, args)
+    write_collation(collator, added_paths, collated_nb_path, args, stats=stats)
+    return stats
+
+
+def write_collation(collator, submission_paths, collated_nb_path, args, *,
+                    overwrite=False, stats=NULL_STATS):
+    """Write the collation of the answers in ``collator``, as ``args`` specifies.
+
+    This writes the report, and the collated notebook, its sections, or its
+    delta, and removes duplicate answers from these.
 
-    collated_nb = nbcollate(master_nb, submission_nbs, labels=labels)
+    Args:
+        collator (NotebookCollator): the collator, with the answers added
+        submission_paths ([str]): the paths of the answers' submissions
+        collated_nb_path (str): the output pathname
+        overwrite (bool): if true, replace the output even if ``args.force``
+            isn't set.
+    """
+    if args.report:
+        collator.completion_matrix(students=submission_paths).write(args.report)
+    outputs = None
+    if args.dedupe_outputs:
+        from .outputs import OutputStore
+        outputs = OutputStore(os.path.splitext(collated_nb_path)[0] + '_files',
+                              dry_run=bool(args.dry_run))
+    if args.split_sections:
+        write_sections(collator, collated_nb_path, args, overwrite=overwrite,
+                       outputs=outputs, stats=stats)
+        return
+    collated_nb = collator.finish()
     if not args.label:
-        nbc.remove_duplicate_answers(collated_nb)
+        sections = collator.section_index(collated_nb)
+        with stats.stage('dedup'):
+            nbc.remove_duplicate_answers(collated_nb, sections=sections)
+        if args.cluster_answers is not None:
+            with stats.stage('cluster'):
+                nbc.sort_answers(collated_nb, similarity=args.cluster_answers,
+                                 sections=sections)
         # nbc.sort_answers(collated_nb)
 
-    suffix = "-collated"
-    root, ext = os.path.splitext(args.notebook_files[0])
-    collated_nb_path = "{}{}{}".format(root, suffix, ext)
-    if args.out:
-        collated_nb_path = os.path.join(
-            args.out, os.path.split(collated_nb_path)[1])
-    if not args.force and os.path.exists(collated_nb_path):
-        # FIXME raise condition; instead open w/ os.O_CREAT | os.O_WRONLY
-        err = FileExistsError()
-        err.filename = collated_nb_path
-        raise err
-    if not args.dry_run:
-        with open(collated_nb_path, 'w') as f:
-            nbformat.write(collated_nb, f)
-    print('wrote', collated_nb_path)
+    if args.delta:
+        write_delta(collated_nb, collated_nb_path, args.delta, args, outputs=outputs,
+                    stats=stats)
+        return
+    write_collated(collated_nb, collated_nb_path, args, overwrite=overwrite,
+                   outputs=outputs, stats=stats)
+
+
+def watch(master_nb_path, submission_paths, args):
+    """Collate notebooks, and re-collate them whenever a submission changes.
+
+    Arguments are as for :func:`collate`. Directories in ``submission_paths``
+    are re-scanned for new notebooks.
+    """
+    from .watch import CollationWatcher
+
+    collated_nb_path = collated_path(master_nb_path, args)
+    # Statistics accumulate across re-collations.
+    stats = CollationStats() if args.stats else NULL_STATS
+    watcher = CollationWatcher(master_nb_path, submission_paths, label=args.label,
+                               clear_outputs=args.clear_outputs,
+                               similarity=args.similarity, jobs=args.jobs,
+                               cache=AnswerCache(args.cache) if args.cache else None,
+                               validate=not args.trust_inputs, stats=stats,
+                               exclude=[collated_nb_path])
+    written = []
+
+    def write():
+        collator = watcher.make_collator(ids=bool(args.delta), stats=stats)
+        write_collation(collator, watcher.submissions(), collated_nb_path, args,
+                        overwrite=bool(written), stats=stats)
+        written.append(collated_nb_path)
+        if args.stats:
+            write_stats(stats.as_dict(), args.stats)
+
+    watcher.poll()
+    write()
+    watcher.run(write)
+
+
+def serve(assignment_paths, args):
+    """Serve collations over HTTP on localhost until interrupted.
+
+    Each notebook in ``assignment_paths`` is added as an assignment, named by
+    its filename without the extension. See :mod:`nbcollate.server`.
+
+    Returns:
+        bool: false if an assignment couldn't be read. The server isn't started.
+    """
+    from .server import CollationServer, RequestError
+
+    server = CollationServer(('127.0.0.1', args.serve), label=args.label,
+                             clear_outputs=args.clear_outputs,
+                             validate=not args.trust_inputs,
+                             similarity=args.similarity, verbose=args.verbose)
+    try:
+        for path in assignment_paths:
+            name = os.path.splitext(os.path.basename(path))[0]
+            try:
+                with open(path, 'rb') as f:
+                    server.put_assignment(f.read(), name)
+            except (OSError, RequestError) as e:
+                sys.stderr.write('{}: {}\n'.format(path, e))
+                return False
+        print('Serving collations at', server.url, file=sys.stderr)
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+    finally:
+        server.server_close()
+    return True
 
 
 def main(args=sys.argv[1:]):
     "Create a collated notebook."
     parser = argparse.ArgumentParser(description=__doc__)
-    nb_nargs = '*' if '--version' in args else '+'
+    optional_nbs = any(arg.startswith(('--version', '--batch', '--serve'))
+                       for arg in args)
+    nb_nargs = '*' if optional_nbs else '+'
     parser.add_argument('-f', '--force', action='store_true',
                         help="Force overwrite existing file")
     parser.add_argument('-n', '--dry-run', help="Dry run")
     parser.add_argument('-o', '--out', type=str, help="Output directory")
     parser.add_argument('-v', '--verbose', action='store_true')
+    parser.add_argument('-j', '--jobs', type=int, default=1, metavar='N',
+                        help="Read notebooks using N processes (0 for one per CPU)")
     parser.add_argument('--label', action='store_true',
                         help="Label answers by notebook")
+    parser.add_argument('--clear-outputs', action='store_true',
+                        help="Clear cell outputs; they're skipped when notebooks "
+                             "are read")
+    parser.add_argument('--similarity', type=float, metavar='THRESHOLD',
+                        help="Match edited prompt cells that are at least THRESHOLD "
+                             "(0 to 1) similar to an assignment cell")
+    parser.add_argument('--cluster-answers', type=float, metavar='THRESHOLD',
+                        help="Replace answers that are at least THRESHOLD (0 to 1) "
+                             "similar by one answer and a count (without --label)")
+    parser.add_argument('--trust-inputs', action='store_true',
+                        help="Skip schema validation of submissions")
+    parser.add_argument('--cache', type=str, metavar='DIR',
+                        help="Cache the answers from each notebook in DIR")
+    parser.add_argument('--stats', type=str, metavar='FILE',
+                        help="Write stage timings and counts as JSON to FILE "
+                             "('-' for stderr)")
+    parser.add_argument('--split-sections', action='store_true',
+                        help="Write a notebook per section, and an index notebook that "
+                             "links to them")
+    parser.add_argument('--dedupe-outputs', action='store_true',
+                        help="Write each distinct image output or attachment once, to "
+                             "a directory next to the collated notebook")
+    parser.add_argument('--report', type=str, metavar='FILE',
+                        help="Write the number of answer cells per student and prompt "
+                             "to FILE, as CSV if it ends in .csv and otherwise as JSON")
+    parser.add_argument('--batch', type=str, metavar='MANIFEST',
+                        help="Collate each assignment listed in a JSON or TOML "
+                             "manifest")
+    parser.add_argument('--watch', action='store_true',
+                        help="Re-collate whenever a submission file changes")
+    parser.add_argument('--serve', type=int, metavar='PORT',
+                        help="Serve collations over HTTP on localhost port PORT; "
+                             "NOTEBOOK_FILE arguments are assignments")
+    parser.add_argument('--delta', type=str, metavar='FILE',
+                        help="Write the changes since the previous collated notebook "
+                             "to FILE, and rewrite the notebook only if it changed")
+    parser.add_argument('--apply-delta', type=str, metavar='FILE',
+                        help="Update NOTEBOOK_FILE in place with the changes in FILE")
     parser.add_argument('--version', action='store_true')
     parser.add_argument('notebook_files', nargs=nb_nargs, metavar='NOTEBOOK_FILE')
     args = parser.parse_args(args)
     if args.version:
         print('nbcollate version', nbc.__version__)
         return
+    if args.label and args.cluster_answers is not None:
+        parser.error('--cluster-answers is not allowed with --label')
+    if args.delta and args.split_sections:
+        parser.error('--delta is not allowed with --split-sections')
+    if args.apply_delta:
+        if len(args.notebook_files) != 1:
+            parser.error('--apply-delta takes one NOTEBOOK_FILE')
+        apply_delta_file(args.apply_delta, args.notebook_files[0])
+        return
+    if args.batch:
+        if args.notebook_files:
+            parser.error('NOTEBOOK_FILE arguments are not allowed with --batch')
+        from .batch import run_batch
+        if not run_batch(args.batch, args):
+            sys.exit(1)
+        return
+    if args.serve is not None:
+        if not serve(args.notebook_files, args):
+            sys.exit(1)
+        return
     if not args.notebook_files:
         parser.error('the following arguments are required: NOTEBOOK_FILE')
     master_file, *submission_files = args.notebook_files
-    # Remove the master file from the answer files. This allows the CLI
-    # to be used in the pattern `nbcollate master.ipynb *.ipynb`.
-    if master_file in submission_files:
-        submission_files = [f for f in submission_files if f != master_file]
     try:
-        collate(master_file, submission_files, args)
+        if args.watch:
+            watch(master_file, submission_files, args)
+            return
+        # Remove the master file and the output file from the answer files.
+        # This allows the CLI to be used in the pattern
+        # `nbcollate master.ipynb *.ipynb`.
+        submission_files = expand_paths(
+            submission_files, exclude=[master_file, collated_path(master_file, args)])
+        stats = collate(master_file, submission_files, args)
+        if args.stats:
+            write_stats(stats.as_dict(), args.stats)
     except FileExistsError:
         sys.stderr.write("Output file already exists. "
                          "Repeat with --force to replace it.\n")
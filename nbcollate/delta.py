@@ -0,0 +1,135 @@
+"""Patches between successive versions of a collated notebook.
+
+Re-collating after a few submissions are added or changed alters only the
+cells of those submissions. A patch records just those cells, so that it's
+small when the change is, and a copy of the previous collated notebook can
+be brought up to date by applying it.
+
+A patch is a JSON-serializable dict::
+
+    {"nbcollate_delta": 1,
+     "base": digest of the cells that the patch applies to,
+     "result": digest of the cells that it produces,
+     "sources": the nbcollate_source ids of the inserted and deleted cells,
+     "metadata": the notebook metadata, if this changed,
+     "cells": [[start, end, [cell, ...]], ...]}
+
+Each entry of ``cells`` replaces the base cells ``start:end``. The entries
+are in order and don't overlap.
+"""
+
+import hashlib
+import json
+from difflib import SequenceMatcher
+
+from .nbcollate import SOURCE_METADATA_KEY
+
+DELTA_VERSION = 1
+
+
+def cell_keys(nb):
+    """Return a string for each cell of ``nb``, that is equal only for equal cells."""
+    return [json.dumps(cell, sort_keys=True) for cell in nb['cells']]
+
+
+def cells_digest(keys):
+    """Return a hex digest of a list of :func:`cell_keys`."""
+    h = hashlib.sha256()
+    for key in keys:
+        h.update(key.encode())
+        h.update(b'\0')
+    return h.hexdigest()
+
+
+def make_cell_ids_unique(nb):
+    """Replace repeated cell ids in ``nb``, in place.
+
+    Answer cells from different submissions often have the same id, since
+    they're copied from the same cell of the assignment. nbformat replaces
+    repeated ids by random ones when it writes the notebook, which would make
+    each collation differ from the last. The ids here are derived from the
+    cell's ``nbcollate_source`` and original id, so they're stable.
+    """
+    seen = set()
+    for cell in nb['cells']:
+        cell_id = cell.get('id')
+        if cell_id is None:
+            continue
+        n = 0
+        while cell_id in seen:
+            source_id = cell['metadata'].get(SOURCE_METADATA_KEY)
+            data = json.dumps([cell['id'], source_id, n], default=str).encode()
+            cell_id = hashlib.sha256(data).hexdigest()[:8]
+            n += 1
+        if cell_id != cell['id']:
+            cell['id'] = cell_id
+        seen.add(cell_id)
+    return nb
+
+
+def notebook_delta(old_nb, new_nb):
+    """Return a patch that turns ``old_nb`` into ``new_nb``.
+
+    Cells are compared whole. Answer cells from different submissions are
+    distinct even if their sources are the same, since their
+    ``nbcollate_source`` metadata differs.
+
+    Args:
+        old_nb (Notebook): the previous notebook, or None to make a patch
+            that applies to a notebook with no cells.
+        new_nb (Notebook): the new notebook
+
+    Returns:
+        dict: the patch
+    """
+    old_keys = cell_keys(old_nb) if old_nb is not None else []
+    new_keys = cell_keys(new_nb)
+    matcher = SequenceMatcher(None, old_keys, new_keys, autojunk=False)
+    new_cells = new_nb['cells']
+    old_cells = old_nb['cells'] if old_nb is not None else []
+    cells = []
+    sources = set()
+    for op, i1, i2, j1, j2 in matcher.get_opcodes():
+        if op == 'equal':
+            continue
+        cells.append([i1, i2, new_cells[j1:j2]])
+        for cell in old_cells[i1:i2] + new_cells[j1:j2]:
+            source_id = cell['metadata'].get(SOURCE_METADATA_KEY)
+            if source_id is not None:
+                sources.add(source_id)
+    delta = {
+        'nbcollate_delta': DELTA_VERSION,
+        'base': cells_digest(old_keys),
+        'result': cells_digest(new_keys),
+        'sources': sorted(sources, key=str),
+        'cells': cells,
+    }
+    if old_nb is None or old_nb['metadata'] != new_nb['metadata']:
+        delta['metadata'] = new_nb['metadata']
+    return delta
+
+
+def is_empty_delta(delta):
+    """Return true if ``delta`` makes no change."""
+    return not delta['cells'] and 'metadata' not in delta
+
+
+def apply_delta(nb, delta):
+    """Apply a patch from :func:`notebook_delta` to ``nb``, in place.
+
+    Raises:
+        ValueError: if ``nb`` isn't the notebook that the patch was made from.
+    """
+    from nbformat import from_dict
+
+    if delta.get('nbcollate_delta') != DELTA_VERSION:
+        raise ValueError('unsupported delta version: {!r}'.format(
+            delta.get('nbcollate_delta')))
+    if cells_digest(cell_keys(nb)) != delta['base']:
+        raise ValueError("the delta doesn't apply to this notebook")
+    cells = nb['cells']
+    for start, end, new_cells in reversed(delta['cells']):
+        cells[start:end] = [from_dict(cell) for cell in new_cells]
+    if 'metadata' in delta:
+        nb['metadata'] = from_dict(delta['metadata'])
+    return nb
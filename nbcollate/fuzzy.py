@@ -0,0 +1,196 @@
+"""Find near matches of cell sources.
+
+Each string is represented by its set of character shingles (substrings of
+length :data:`SHINGLE_SIZE`), and strings are compared by the Jaccard
+similarity of these sets.
+
+:class:`MinHashIndex` finds the near matches of one string among many.
+Strings whose shingle sets have a high Jaccard similarity are likely to share
+a band of their MinHash signatures, so a query is compared only with the
+indexed strings that share a band with it, rather than with every indexed
+string. The Jaccard similarity of two sets is at most the ratio of their
+sizes, so strings whose sizes are too different aren't compared at all.
+:func:`cluster` groups a list of strings by similarity.
+"""
+
+import bisect
+import random
+import zlib
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+SHINGLE_SIZE = 3
+
+# The hash functions are (a * h + b) % _PRIME, for 32-bit shingle hashes h. With
+# a 31-bit prime, these fit in 64-bit integers, so NumPy can compute them.
+_PRIME = (1 << 31) - 1
+
+# A query is compared directly with up to this many candidates, which costs
+# about as much as computing its signature. The signature is only used to
+# narrow down more candidates than this.
+_DIRECT_LIMIT = 256 if np is None else 16
+
+
+def shingles(text, size=SHINGLE_SIZE):
+    """Return the set of character shingles of ``text``, after collapsing whitespace."""
+    text = ' '.join(text.split())
+    if len(text) <= size:
+        return {text}
+    return {text[i:i + size] for i in range(len(text) - size + 1)}
+
+
+def jaccard(a, b):
+    """Return the Jaccard similarity of two sets."""
+    if not (a or b):
+        return 1.0
+    n = len(a & b)
+    return n / (len(a) + len(b) - n)
+
+
+class MinHashIndex(object):
+    """An index of strings, that finds the indexed string most similar to a query.
+
+    Args:
+        strings ([str]): the strings to index. Empty strings are ignored.
+        threshold (float): the minimum Jaccard similarity of the shingle sets
+            of a query and a match.
+        bands (int): the number of signature bands
+        rows (int): the number of signature rows in each band. More rows
+            produce fewer candidates for each query, at the risk of missing
+            matches near the threshold.
+    """
+
+    def __init__(self, strings, threshold=0.8, *, bands=20, rows=3):
+        self.threshold = threshold
+        self.rows = rows
+        rng = random.Random(0)
+        params = [(rng.randrange(1, _PRIME), rng.randrange(_PRIME))
+                  for _ in range(bands * rows)]
+        self._hash_params = params
+        if np is not None:
+            self._a, self._b = (np.array(p, dtype=np.uint64)[:, None]
+                                for p in zip(*params))
+        self._shingles = {}
+        self._buckets = [{} for _ in range(bands)]
+        # (shingle set size, index), sorted
+        self._sizes = []
+        for i, s in enumerate(strings):
+            if not s:
+                continue
+            shingle_set = self._shingles[i] = shingles(s)
+            self._sizes.append((len(shingle_set), i))
+            for bucket, key in zip(self._buckets, self._band_keys(shingle_set)):
+                bucket.setdefault(key, []).append(i)
+        self._sizes.sort()
+
+    def _signature(self, shingle_set):
+        hashes = [zlib.crc32(s.encode('utf-8')) for s in shingle_set]
+        if np is not None:
+            h = np.array(hashes, dtype=np.uint64)[None, :]
+            return ((self._a * h + self._b) % _PRIME).min(axis=1).tolist()
+        return [min((a * h + b) % _PRIME for h in hashes)
+                for a, b in self._hash_params]
+
+    def _band_keys(self, shingle_set):
+        signature = self._signature(shingle_set)
+        rows = self.rows
+        return [tuple(signature[i:i + rows]) for i in range(0, len(signature), rows)]
+
+    def _size_candidates(self, size):
+        """Return the indices of the strings whose shingle set sizes are within
+        the threshold ratio of ``size``."""
+        if self.threshold <= 0:
+            return [i for _, i in self._sizes]
+        lo = bisect.bisect_left(self._sizes, (size * self.threshold, -1))
+        hi = bisect.bisect_right(self._sizes, (size / self.threshold, len(self._sizes)))
+        return [i for _, i in self._sizes[lo:hi]]
+
+    def query(self, text, accept=None):
+        """Return the index of the most similar string, or None if none is close enough.
+
+        Args:
+            text (str): the query
+            accept: if supplied, only indexed strings whose index this returns
+                true for are matched.
+        """
+        if not text:
+            return None
+        shingle_set = shingles(text)
+        candidates = self._size_candidates(len(shingle_set))
+        if accept is not None:
+            candidates = [i for i in candidates if accept(i)]
+        # Comparing a few candidates directly is cheaper than computing the
+        # query's signature, and finds every match.
+        if len(candidates) > _DIRECT_LIMIT:
+            in_bands = set()
+            for bucket, key in zip(self._buckets, self._band_keys(shingle_set)):
+                in_bands.update(bucket.get(key, ()))
+            candidates = [i for i in candidates if i in in_bands]
+        best, best_similarity = None, 0
+        for i in sorted(candidates):
+            similarity = jaccard(shingle_set, self._shingles[i])
+            if similarity > best_similarity:
+                best, best_similarity = i, similarity
+        return best if best_similarity >= self.threshold else None
+
+
+def cluster(strings, threshold=0.8):
+    """Group similar strings.
+
+    Each cluster is led by the first string that isn't in an earlier cluster,
+    and holds the remaining strings whose similarity to the leader (the
+    Jaccard similarity of their shingle sets) is at least ``threshold``.
+    Similarities are computed as a matrix product if NumPy is installed.
+
+    Returns:
+        [[int]]: the indices of the strings in each cluster. Clusters, and the
+        indices in each cluster, are in order of their first string.
+    """
+    shingle_sets = [shingles(s) for s in strings]
+    if np is not None:
+        return _cluster_matrix(shingle_sets, threshold)
+    leaders = [None] * len(strings)
+    clusters = []
+    for i, a in enumerate(shingle_sets):
+        if leaders[i] is not None:
+            continue
+        members = [i] + [j for j in range(i + 1, len(strings))
+                         if leaders[j] is None
+                         and jaccard(a, shingle_sets[j]) >= threshold]
+        for j in members:
+            leaders[j] = i
+        clusters.append(members)
+    return clusters
+
+
+def _cluster_matrix(shingle_sets, threshold):
+    n = len(shingle_sets)
+    # Only shingles that occur in more than one string contribute to
+    # intersections, so the matrix has a column for each of those.
+    counts = {}
+    for shingle_set in shingle_sets:
+        for shingle in shingle_set:
+            counts[shingle] = counts.get(shingle, 0) + 1
+    columns = {}
+    for shingle, count in counts.items():
+        if count > 1:
+            columns[shingle] = len(columns)
+    matrix = np.zeros((n, len(columns)), dtype=np.float32)
+    for i, shingle_set in enumerate(shingle_sets):
+        matrix[i, [columns[s] for s in shingle_set if s in columns]] = 1
+    intersections = (matrix @ matrix.T).astype(np.float64)
+    sizes = np.array([len(s) for s in shingle_sets], dtype=np.float64)
+    similarities = intersections / (sizes[:, None] + sizes[None, :] - intersections)
+    np.fill_diagonal(similarities, 1)
+    leaders = np.full(n, -1)
+    clusters = []
+    for i in range(n):
+        if leaders[i] >= 0:
+            continue
+        members = np.flatnonzero((similarities[i] >= threshold) & (leaders < 0))
+        leaders[members] = i
+        clusters.append(members.tolist())
+    return clusters
@@ -10,14 +10,17 @@ Rewritten by Oliver Steele
 """
 
 import re
-from collections import namedtuple
 from difflib import SequenceMatcher
-from itertools import starmap
 
-import nbformat
+from .cache import digest
+from .stats import NULL_STATS
 
 # QUESTION_RE = r'#+ (Exercise|Question)'
+HEADER_RE = r'^##+\s*(.+)'
 SOURCE_METADATA_KEY = 'nbcollate_source'
+CLUSTER_SIZE_METADATA_KEY = 'nbcollate_cluster_size'
+
+_header_match = re.compile(HEADER_RE).match
 
 
 def nb_clear_outputs(nb):
@@ -31,17 +34,20 @@ def nb_clear_outputs(nb):
             cell['outputs'] = []
 
 
-def nbcollate(assignment_nb, answer_nbs, *, ids=None, labels=None, clear_outputs=False):
+def nbcollate(assignment_nb, answer_nbs, *, ids=None, labels=None, clear_outputs=False,
+              copy_cells=True, similarity=None, cache=None, stats=None):
     """Create a notebook based on assignment_nb, that incorporates answers from answer_nbs.
 
     Arguments
     ---------
     assignment_nb: Notebook
-        A Jupyter notebook with the assignment.
+        A Jupyter notebook with the assignment, or an :class:`AssignmentIndex`
+        of one. Pass an index to reuse it across calls.
     answer_nbs: object
         A :class:`dict` or iterable whose values are notebooks with answers.
         If this value is a :class:`dict`, its keys are ids and its values are
-        the corresponding notebooks.
+        the corresponding notebooks. An iterable is consumed one notebook at a
+        time; see :class:`NotebookCollator`.
     labels: [str]
         If non-empty, this should have the same length as ``answer_nbs``.
         A header is placed before each run of cells from a notebook in
@@ -50,8 +56,23 @@ def nbcollate(assignment_nb, answer_nbs, *, ids=None, labels=None, clear_outputs
         If non-empty, this should have the same length as ``answer_nbs``.
         Each cell from an answer notebook has metadata ``nbcollate_source``
         set to the element from ``ids``.
-    ids: bool
+    clear_outputs: bool
         If true, cell output is cleared.
+    copy_cells: bool
+        If false, cells that collation doesn't modify are shared with
+        ``assignment_nb`` and ``answer_nbs``, instead of copied. This uses
+        less memory, but modifying such a cell in place also modifies the
+        input notebook.
+    similarity: float
+        If set, answer cells that are similar to an assignment cell, with at
+        least this similarity, are matched to it. See :class:`AssignmentIndex`.
+    cache: AnswerCache
+        If supplied, the answer cell positions that are computed for each
+        answer notebook are stored here, and reused for notebooks with the
+        same cell sources.
+    stats: CollationStats
+        If supplied, the time spent in each stage of the collation, and
+        counts of the cells that are processed, are recorded here.
 
     Returns
     -------
@@ -60,41 +81,252 @@ def nbcollate(assignment_nb, answer_nbs, *, ids=None, labels=None, clear_outputs
     if isinstance(answer_nbs, dict):
         assert not ids
         ids = list(answer_nbs.keys())
-        answer_nbs = list(answer_nbs.values())
-
-    Opcode = namedtuple('opcode', ['op', 'i1', 'i2', 'j1', 'j2'])
-
-    def opcodes(nb):
-        return starmap(Opcode, NotebookMatcher(assignment_nb, nb).get_opcodes())
-
-    changes = sorted((oc.i2, i, oc, nb.cells[oc.j1:oc.j2])
-                     for i, nb in enumerate(answer_nbs)
-                     for oc in opcodes(nb))
-    output_cells = assignment_nb.cells[:]
-    di = 0
-    for _, i, opcode, b_cells in changes:
-        op, i1, i2, j1, j2 = opcode
-        if op in ('insert', 'replace'):
-            i0 = i2 + di
-            b_cells = [c.copy() for c in b_cells]
-            if ids:
-                for c in b_cells:
-                    c.metadata = c.metadata.copy()
-                    c.metadata[SOURCE_METADATA_KEY] = ids[i]
-            if labels:
-                b_cells = [make_label_cell(labels[i])] + b_cells
-            output_cells[i0:i0] = b_cells
-            di += len(b_cells)
-    nb = assignment_nb.copy()
-    nb.cells = [c.copy() for c in output_cells if c.source.strip()]
-    if clear_outputs:
-        nb_clear_outputs(nb)
-    return nb
-
-
-def make_label_cell(label):
-    """Create a cell that labels a collated notebook with ``label``."""
-    return nbformat.v4.new_markdown_cell(source='**{}**'.format(label))
+        answer_nbs = answer_nbs.values()
+    collator = NotebookCollator(assignment_nb, clear_outputs=clear_outputs,
+                                copy_cells=copy_cells, similarity=similarity,
+                                cache=cache, stats=stats)
+    for i, answer_nb in enumerate(answer_nbs):
+        collator.add(ids[i] if ids else None, answer_nb,
+                     label=labels[i] if labels else None)
+    return collator.finish()
+
+
+class NotebookCollator(object):
+    """Collate answer notebooks into an assignment notebook, one at a time.
+
+    :meth:`add` retains only the answer cells of each notebook, so the caller
+    can drop a notebook (and its outputs) once it has been added. This keeps
+    memory proportional to the answers, rather than to the notebooks::
+
+        collator = NotebookCollator(assignment_nb)
+        for path in paths:
+            collator.add(path, nbformat.read(path, as_version=4))
+        nb = collator.finish()
+
+    Args:
+        assignment_nb (Notebook): the assignment notebook, or an
+            :class:`AssignmentIndex` of one.
+        clear_outputs (bool): if true, cell output is cleared.
+        copy_cells (bool): if false, :meth:`finish` shares the cells that
+            collation doesn't modify with the input notebooks, instead of
+            copying them.
+        similarity (float): if set, answer cells are matched approximately
+            to assignment cells; see :class:`AssignmentIndex`.
+        cache (AnswerCache): if supplied, the answer cell positions in each
+            answer notebook are cached here, keyed by the cell sources.
+        stats (CollationStats): if supplied, stage timings and cell counts
+            are recorded here.
+    """
+
+    def __init__(self, assignment_nb, *, clear_outputs=False, copy_cells=True,
+                 similarity=None, cache=None, stats=None):
+        if isinstance(assignment_nb, AssignmentIndex):
+            assert similarity is None, 'similarity is set by the AssignmentIndex'
+            self.index = assignment_nb
+        else:
+            self.index = AssignmentIndex(assignment_nb, similarity=similarity)
+        self.clear_outputs = clear_outputs
+        self.copy_cells = copy_cells
+        self.cache = cache
+        self.stats = stats or NULL_STATS
+        # [id, label, [(k, [CellRecord])]], in the order they were added
+        self._entries = []
+        self._output_records = ()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def extract(self, nb):
+        """Return the answer cells from an answer notebook.
+
+        Returns:
+            [(k, [cell])]: runs of answer cells, each paired with the index of
+            the assignment cell that the run precedes. ``k`` is the number
+            of assignment cells for a run that follows the last one.
+        """
+        return [(k, nb.cells[j1:j2]) for k, j1, j2 in self._answer_spans(nb)]
+
+    def _extract_records(self, nb):
+        # Records are made only for the answer cells.
+        return [(k, [CellRecord(cell) for cell in nb.cells[j1:j2]])
+                for k, j1, j2 in self._answer_spans(nb)]
+
+    def _answer_spans(self, nb):
+        with self.stats.stage('diff'):
+            strings = cell_strings(nb)
+            # Cell types affect only approximate matches.
+            types = cell_types(nb) if self.index.similarity is not None else None
+            if self.cache is None:
+                spans = self._diff_spans(strings, types)
+            else:
+                key = self.cache.key('spans', self.index.digest,
+                                     digest(strings if types is None
+                                            else [strings, types]))
+                spans = self.cache.get(key)
+                if spans is None:
+                    spans = self._diff_spans(strings, types)
+                    self.cache.put(key, spans)
+        self.stats.count('cells_diffed', len(nb.cells))
+        return spans
+
+    def _diff_spans(self, strings, types=None):
+        return [(i2, j1, j2)
+                for op, _, i2, j1, j2 in self.index.string_opcodes(strings, types)
+                if op in ('insert', 'replace')]
+
+    def add(self, id, nb, label=None):
+        """Add the answers from an answer notebook.
+
+        Args:
+            id: if not None, each answer cell has metadata
+                ``nbcollate_source`` set to this value.
+            nb (Notebook): the answer notebook
+            label (str): if not None, a header with this text is placed before
+                each run of answer cells.
+        """
+        self._add_records(id, self._extract_records(nb), label)
+
+    def add_answers(self, id, answers, label=None):
+        """Add answer cells that were returned by :meth:`extract`.
+
+        See :meth:`add` for the arguments.
+        """
+        self._add_records(id, [(k, [CellRecord(c) for c in cells])
+                               for k, cells in answers], label)
+
+    def _add_records(self, id, answers, label):
+        runs = []
+        with self.stats.stage('copy'):
+            for k, records in answers:
+                records = [self._answer_record(r, id) for r in records if r.source]
+                runs.append((k, records))
+                self.stats.count('cells_inserted', len(records))
+        self._entries.append([id, label, runs])
+        self.stats.count('submissions')
+
+    def _answer_record(self, record, id):
+        cell = self._answer_cell(record.cell, id)
+        if cell is record.cell:
+            return record
+        if id is None:
+            return record.replace(cell)
+        return record.replace(cell, source_id=id)
+
+    def _answer_cell(self, cell, id):
+        # Answer cells are copied only if they're modified. Unmodified cells
+        # are shared with the answer notebook until finish().
+        fields = {}
+        if id is not None:
+            fields['metadata'] = cell.metadata.copy()
+            fields['metadata'][SOURCE_METADATA_KEY] = id
+        if self.clear_outputs and cell.get('outputs'):
+            fields['outputs'] = []
+        return replace_fields(cell, **fields) if fields else cell
+
+    def _output_cell(self, cell):
+        if self.clear_outputs and cell.get('outputs'):
+            return replace_fields(cell, outputs=[])
+        return cell.copy() if self.copy_cells else cell
+
+    def completion_matrix(self, *, students=None, header=None):
+        """Return a :class:`CompletionMatrix` of the answers added so far.
+
+        See :meth:`CompletionMatrix.from_collator` for the arguments.
+        """
+        from .report import CompletionMatrix
+        return CompletionMatrix.from_collator(self, students=students, header=header)
+
+    def discard(self, id):
+        """Remove the answers that were added with ``id``."""
+        self._entries = [entry for entry in self._entries if entry[0] != id]
+
+    def finish(self):
+        """Return the collated notebook.
+
+        The collator can continue to be used: later calls reflect answers that
+        were added or discarded since.
+        """
+        with self.stats.stage('assemble'):
+            records = list(self.iter_records())
+            nb = self.index.nb.copy()
+            nb.cells = [record.cell for record in records]
+        self._output_records = records
+        self.stats.count('cells_output', len(nb.cells))
+        return nb
+
+    def section_index(self, nb):
+        """Return a :class:`SectionIndex` of the notebook that :meth:`finish` returned.
+
+        The index reuses the cell records that were computed during collation,
+        instead of recomputing them from the cells.
+        """
+        records, self._output_records = self._output_records, ()
+        return SectionIndex(nb, records=records)
+
+    def iter_cells(self):
+        """Generate the cells of the collated notebook.
+
+        The cells are produced as they're generated, so a caller that writes
+        them out in pieces, such as :meth:`iter_sections`, doesn't need to
+        hold the whole notebook.
+        """
+        return (record.cell for record in self.iter_records())
+
+    def iter_records(self):
+        """Generate a :class:`CellRecord` for each cell of the collated notebook."""
+        # answers[k] holds the answer cells that precede assignment cell k, in
+        # the order they were added; answers[-1] holds those that follow the
+        # last assignment cell.
+        answers = [[] for _ in range(len(self.index.records) + 1)]
+        for _, label, runs in self._entries:
+            for k, records in runs:
+                if label is not None:
+                    answers[k].append(CellRecord(make_label_cell(label, position=k)))
+                answers[k] += records
+        for record, b_records in zip(self.index.records, answers):
+            yield from self._outputs(b_records)
+            yield from self._outputs([record])
+        yield from self._outputs(answers[-1])
+
+    def _outputs(self, records):
+        return (record.replace(self._output_cell(record.cell))
+                for record in records if record.source)
+
+    def iter_sections(self, *, header=None):
+        """Generate the sections of the collated notebook, as (title, [cell]) pairs.
+
+        See :func:`i_sections`.
+        """
+        return split_sections(self.iter_cells(), header=header)
+
+
+def replace_fields(cell, **fields):
+    """Return a shallow copy of ``cell``, with ``fields`` replaced."""
+    cell = cell.copy()
+    cell.update(fields)
+    return cell
+
+
+def make_label_cell(label, *, position=None):
+    """Create a cell that labels a collated notebook with ``label``.
+
+    Args:
+        label (str): the label
+        position (int): the index of the assignment cell that the label
+            precedes. The cell's id is derived from this and the label.
+    """
+    import nbformat
+    cell = nbformat.v4.new_markdown_cell(source='**{}**'.format(label))
+    return _set_derived_id(cell, ['label', label, position])
+
+
+def _set_derived_id(cell, key):
+    """Replace the random id that nbformat gives a new cell by one derived from
+    ``key``, so that collating the same notebooks again produces the same cell.
+    Repeated ids are replaced by :func:`nbcollate.delta.make_cell_ids_unique`."""
+    if 'id' in cell:
+        cell['id'] = digest(key)[:8]
+    return cell
 
 
 def cell_strings(nb):
@@ -102,11 +334,176 @@ def cell_strings(nb):
     return [cell.source.strip() for cell in nb.cells]
 
 
+def cell_types(nb):
+    """Return the cell types of a notebook's cells."""
+    return [cell['cell_type'] for cell in nb.cells]
+
+
+def cell_records(nb):
+    """Return a :class:`CellRecord` for each cell in a notebook."""
+    return [CellRecord(cell) for cell in nb.cells]
+
+
+class CellRecord(object):
+    """The fields of a cell that collation and post-processing compare.
+
+    These are computed once per cell, rather than by each stage that reads
+    them. Collation passes records from stage to stage, and only copies or
+    modifies the cells themselves for the output notebook. Python caches the
+    hash of a string, so ``source`` serves as a hash key as is.
+
+    Attributes:
+        cell (NotebookNode): the cell
+        cell_type (str): the cell type
+        source (str): the source, stripped of surrounding whitespace
+        line_count (int): the number of lines in ``source``
+        source_id: the answer notebook id; see :func:`get_cell_source_id`
+        title (str): the section title, if the cell is a section header, and
+            otherwise None
+    """
+
+    __slots__ = ('cell', 'cell_type', 'source', 'line_count', 'source_id', 'title')
+
+    def __init__(self, cell, header_match=None):
+        # Item access avoids NotebookNode's slower attribute lookup.
+        source = cell['source']
+        self.cell = cell
+        self.cell_type = cell['cell_type']
+        self.source = source.strip()
+        self.line_count = len(self.source.splitlines())
+        self.source_id = get_cell_source_id(cell)
+        m = (header_match or _header_match)(source)
+        self.title = m.group(1) if m else None
+
+    def replace(self, cell, **fields):
+        """Return a record of ``cell``, a modified copy of this record's cell.
+
+        The copy has the same source and type. ``source_id`` can be passed
+        as a keyword argument, if it differs.
+        """
+        if cell is self.cell and not fields:
+            return self
+        record = CellRecord.__new__(CellRecord)
+        record.cell = cell
+        record.cell_type = self.cell_type
+        record.source = self.source
+        record.line_count = self.line_count
+        record.source_id = fields.get('source_id', self.source_id)
+        record.title = self.title
+        return record
+
+
 def NotebookMatcher(nb1, nb2):
     """A SequenceMatcher whose sequences are the notebook cell strings."""
     return SequenceMatcher(None, cell_strings(nb1), cell_strings(nb2))
 
 
+class AssignmentIndex(object):
+    """The normalized cell sources of an assignment notebook, interned for
+    matching against answer notebooks.
+
+    Each distinct normalized cell source in the assignment is assigned a small
+    integer token once. Matching an answer notebook then compares sequences of
+    integers, and costs time in proportion to the size of the answer notebook.
+    An index can be reused across calls to :func:`nbcollate`.
+
+    If ``similarity`` is set, an answer cell whose source doesn't occur in the
+    assignment, but is similar to an assignment cell's, is matched with that
+    cell. This keeps answers in place when a student edits a prompt cell.
+    Similar cells are found with a :class:`~nbcollate.fuzzy.MinHashIndex`,
+    so that each answer cell isn't compared to every assignment cell. A cell
+    is only matched approximately with a cell of the same type.
+
+    Args:
+        nb (Notebook): the assignment notebook
+        similarity (float): if set, the minimum similarity (the Jaccard
+            similarity of character shingles, from 0 to 1) of an answer cell
+            that matches an assignment cell approximately.
+    """
+
+    # Token for answer cells whose source doesn't occur in the assignment.
+    # These never match an assignment cell, so they can share a token.
+    UNMATCHED = -1
+
+    def __init__(self, nb, *, similarity=None):
+        self.nb = nb
+        self.similarity = similarity
+        self._digest = None
+        self.records = cell_records(nb)
+        self.token_ids = {}
+        self.tokens = [self.token_ids.setdefault(r.source, len(self.token_ids))
+                       for r in self.records]
+        self._fuzzy_index = None
+        self._fuzzy_tokens = {}
+        if similarity is not None:
+            from .fuzzy import MinHashIndex
+            self._fuzzy_index = MinHashIndex(list(self.token_ids), similarity)
+            # token_types[token] is the set of cell types that have its source
+            self._token_types = [set() for _ in self.token_ids]
+            for record, token in zip(self.records, self.tokens):
+                self._token_types[token].add(record.cell_type)
+
+    @property
+    def digest(self):
+        """A digest of the assignment's normalized cell sources and matching options."""
+        if self._digest is None:
+            strings = [record.source for record in self.records]
+            self._digest = digest(strings if self.similarity is None
+                                  else [strings, self.similarity])
+        return self._digest
+
+    def cell_tokens(self, nb):
+        """Return the tokens for the cells of an answer notebook."""
+        return self.string_tokens(cell_strings(nb), cell_types(nb))
+
+    def string_tokens(self, strings, types=None):
+        """Return the tokens for a list of normalized cell sources.
+
+        Args:
+            strings ([str]): the normalized cell sources
+            types ([str]): the cell types. If these are supplied, a cell is only
+                matched approximately with a cell of the same type.
+        """
+        get = self.token_ids.get
+        tokens = [get(s, self.UNMATCHED) for s in strings]
+        if self._fuzzy_index is not None:
+            for i, s in enumerate(strings):
+                if tokens[i] == self.UNMATCHED:
+                    tokens[i] = self._fuzzy_token(s, types[i] if types else None)
+        return tokens
+
+    def _fuzzy_token(self, s, cell_type):
+        key = s, cell_type
+        token = self._fuzzy_tokens.get(key)
+        if token is None:
+            accept = None if cell_type is None else self._type_filter(cell_type)
+            match = self._fuzzy_index.query(s, accept)
+            token = self.UNMATCHED if match is None else match
+            self._fuzzy_tokens[key] = token
+        return token
+
+    def _type_filter(self, cell_type):
+        token_types = self._token_types
+        return lambda token: cell_type in token_types[token]
+
+    def matcher(self, nb):
+        """A SequenceMatcher from the assignment cells to the cells of ``nb``.
+
+        This is equivalent to ``NotebookMatcher(self.nb, nb)``.
+        """
+        return SequenceMatcher(None, self.tokens, self.cell_tokens(nb))
+
+    def opcodes(self, nb):
+        """Return the opcodes that transform the assignment into ``nb``."""
+        return self.matcher(nb).get_opcodes()
+
+    def string_opcodes(self, strings, types=None):
+        """Return the opcodes that transform the assignment into a notebook
+        whose normalized cell sources are ``strings``, and cell types ``types``."""
+        matcher = SequenceMatcher(None, self.tokens, self.string_tokens(strings, types))
+        return matcher.get_opcodes()
+
+
 def i_sections(nb, *, header=None):
     """Generate (title, [cell]) pairs.
 
@@ -117,65 +514,222 @@ def i_sections(nb, *, header=None):
         (title, [cell]). Title is a string, or None if there are cells before
         the first header.
     """
-    matcher = re.compile(header or r'^##+\s*(.+)').match
-    cells = []
-    section = (None, cells)
-    for cell in nb.cells:
+    return split_sections(nb.cells, header=header)
+
+
+def split_sections(cells, *, header=None):
+    """Generate (title, [cell]) pairs from an iterable of cells.
+
+    This is :func:`i_sections`, for cells that aren't (yet) in a notebook.
+    Each section is generated as soon as the header of the next one is read.
+    """
+    matcher = re.compile(header or HEADER_RE).match
+    section_cells = []
+    section = (None, section_cells)
+    for cell in cells:
         m = matcher(cell.source)
         if m:
             if section[-1]:
                 yield section
-            cells = []
-            section = (m.group(1), cells)
-        cells.append(cell)
-    if cells:
+            section_cells = []
+            section = (m.group(1), section_cells)
+        section_cells.append(cell)
+    if section_cells:
         yield section
 
 
-def remove_duplicate_answers(nb):
+class SectionIndex(object):
+    """The sections of a notebook, and the cell data that post-processing uses.
+
+    The index holds a :class:`CellRecord` for each cell, which is computed
+    once per cell, or passed in from collation. The sections are recomputed
+    from the records, without rescanning the cell sources, when the list of
+    cells in the notebook changes. An index can
+    therefore be passed to a series of :func:`remove_duplicate_answers`,
+    :func:`sort_answers`, and :func:`get_answer_tuples` calls, which modify
+    ``nb.cells``. Cells shouldn't be modified in place.
+
+    Args:
+        nb (Notebook): a Jupyter notebook
+        header (str): a regular expression that matches section headers. Its
+            first group is the section title.
+        records ([CellRecord]): records of some or all of the cells in
+            ``nb``, computed with the default ``header``. These are ignored if
+            ``header`` is set.
+    """
+
+    def __init__(self, nb, *, header=None, records=()):
+        self.nb = nb
+        self.header_match = re.compile(header or HEADER_RE).match
+        # id(cell) -> CellRecord
+        self._records = {} if header else {id(r.cell): r for r in records}
+        self._cell_ids = None
+        self._sections = None
+
+    def record(self, cell):
+        """Return the :class:`CellRecord` for a cell."""
+        record = self._records.get(id(cell))
+        if record is None or record.cell is not cell:
+            record = self._records[id(cell)] = CellRecord(cell, self.header_match)
+        return record
+
+    def sections(self):
+        """Return a list of (title, [cell]) pairs, as :func:`i_sections` generates."""
+        cell_ids = [id(cell) for cell in self.nb.cells]
+        if cell_ids != self._cell_ids:
+            self._sections = list(self._iter_sections())
+            # Forget the cells that are no longer in the notebook.
+            self._records = {i: self._records[i] for i in cell_ids}
+            self._cell_ids = cell_ids
+        return self._sections
+
+    def _iter_sections(self):
+        cells = []
+        section = (None, cells)
+        for cell in self.nb.cells:
+            title = self.record(cell).title
+            if title is not None:
+                if section[-1]:
+                    yield section
+                cells = []
+                section = (title, cells)
+            cells.append(cell)
+        if cells:
+            yield section
+
+
+def _section_index(nb, sections):
+    if sections is None:
+        return SectionIndex(nb)
+    if sections.nb is not nb:
+        raise ValueError('the section index is for a different notebook')
+    return sections
+
+
+ANSWER_KEYS = {
+    'source': lambda cell: cell.source.strip(),
+    'whitespace': lambda cell: ' '.join(cell.source.split()),
+    'type': lambda cell: (cell.cell_type, cell.source.strip()),
+    'fuzzy': lambda cell: re.sub(r'[\W_]+', '', cell.source.lower()),
+}
+"""Functions that compute the keys that :func:`remove_duplicate_answers`
+compares cells by."""
+
+
+def remove_duplicate_answers(nb, *, key='source', sections=None):
     """Modify a notebook to remove duplicate answers within each section.
 
+    Within a section, a cell is removed if an earlier cell has the same key.
+
     Args:
         nb (Notebook): A Jupyter notebook. This is modified in place.
+        key (str or callable): A function from a cell to a hashable key, or
+            the name of one of these keys:
+
+            - ``'source'``: the source, stripped of surrounding whitespace.
+            - ``'whitespace'``: the source, with whitespace runs collapsed.
+            - ``'type'``: the cell type, and the stripped source.
+            - ``'fuzzy'``: the lowercased source, without whitespace or
+              punctuation.
+        sections (SectionIndex): an index of ``nb``, to share with other calls.
     """
-    dups = []
-    for _, cells in i_sections(nb):
+    index = _section_index(nb, sections)
+    if key == 'source':
+        def key(cell):
+            return index.record(cell).source
+    elif not callable(key):
+        key = ANSWER_KEYS[key]
+    out = []
+    for _, cells in index.sections():
         seen = set()
         for c in cells:
-            h = c.source.strip()
-            if h in seen:
-                dups.append(c)
-            seen.add(h)
-    for d in dups:
-        nb.cells.remove(d)
+            h = key(c)
+            if h not in seen:
+                out.append(c)
+                seen.add(h)
+    nb.cells = out
 
 
-def sort_answers(nb):
+def sort_answers(nb, *, similarity=None, sections=None):
     """Sort the answers within each section by length, and then alphabetically.
 
+    If ``similarity`` is set, near-duplicate answers are also clustered. Within
+    each section, answers whose similarity to the first answer of a cluster is
+    at least ``similarity`` (from 0 to 1; see :func:`nbcollate.fuzzy.cluster`)
+    are replaced by that answer, followed by a cell that counts them. The
+    first answer has metadata ``nbcollate_cluster_size``. Clusters are sorted
+    by their first answer. In this mode, the section header stays first.
+
     Args:
         nb (Notebook): A Jupyter notebook. This is modified in place.
+        similarity (float): if set, cluster similar answers.
+        sections (SectionIndex): an index of ``nb``, to share with other calls.
     """
+    index = _section_index(nb, sections)
+
     def cell_key(cell):
-        return (len(cell.source.strip().splitlines()), cell.source.strip())
+        record = index.record(cell)
+        return (record.line_count, record.source)
 
     out = []
-    for _, cells in i_sections(nb):
-        out += sorted(cells, key=cell_key)
+    for title, cells in index.sections():
+        if similarity is None:
+            out += sorted(cells, key=cell_key)
+            continue
+        if title is not None:
+            out.append(cells[0])
+            cells = cells[1:]
+        out += _clustered_cells(cells, similarity, index, cell_key)
     nb.cells = out
 
 
+def _clustered_cells(cells, similarity, index, cell_key):
+    from .fuzzy import cluster
+
+    clusters = cluster([index.record(c).source for c in cells], similarity)
+    out = []
+    for members in sorted(clusters, key=lambda members: cell_key(cells[members[0]])):
+        cell = cells[members[0]]
+        if len(members) > 1:
+            metadata = cell.metadata.copy()
+            metadata[CLUSTER_SIZE_METADATA_KEY] = len(members)
+            out += [replace_fields(cell, metadata=metadata),
+                    make_cluster_cell(len(members) - 1, answer=cell)]
+        else:
+            out.append(cell)
+    return out
+
+
+def make_cluster_cell(count, *, answer=None):
+    """Create a cell that follows an answer, and counts ``count`` similar answers.
+
+    Args:
+        count (int): the number of similar answers
+        answer (NotebookNode): the answer cell that this follows. The cell's
+            id is derived from this cell's id and source notebook.
+    """
+    import nbformat
+    cell = nbformat.v4.new_markdown_cell(
+        source='*{} similar answer{}*'.format(count, '' if count == 1 else 's'))
+    answer_key = None
+    if answer is not None:
+        answer_key = [answer.get('id'), str(get_cell_source_id(answer))]
+    return _set_derived_id(cell, ['cluster', count, answer_key])
+
+
 def get_cell_source_id(cell):
     """Return an answer notebook id that was placed in a cell by :func:`nbcollate`."""
-    return getattr(cell.metadata, SOURCE_METADATA_KEY, None)
+    return cell['metadata'].get(SOURCE_METADATA_KEY)
 
 
-def get_answer_tuples(nb):
+def get_answer_tuples(nb, *, sections=None):
     """Return a set of tuples (student_id, prompt_title) of answered prompts.
 
     Args:
         nb (Notebook): a Jupyter notebook
+        sections (SectionIndex): an index of ``nb``, to share with other calls.
     """
-    return {(title, get_cell_source_id(c))
-            for title, cells in i_sections(nb)
-            for c in cells if get_cell_source_id(c) is not None}
+    index = _section_index(nb, sections)
+    return {(title, index.record(c).source_id)
+            for title, cells in index.sections()
+            for c in cells if index.record(c).source_id is not None}
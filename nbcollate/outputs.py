@@ -0,0 +1,149 @@
+"""Store cell output and attachment payloads outside a notebook, once per
+distinct payload."""
+
+import base64
+import os
+import re
+
+import nbformat
+
+from .cache import digest
+from .nbcollate import replace_fields
+from .stats import NULL_STATS
+
+BINARY_MIME_TYPES = {'image/png': '.png', 'image/jpeg': '.jpg', 'image/gif': '.gif'}
+TEXT_MIME_TYPES = {'image/svg+xml': '.svg'}
+FILES_METADATA_KEY = 'nbcollate_files'
+
+
+class OutputStore(object):
+    """A directory of output payloads, named by their digests.
+
+    Collated notebooks often contain many copies of the same output, such as
+    the plot that every student's solution draws. :meth:`externalize` writes
+    each distinct image to the directory once, and removes the copies from the
+    notebook. An output that has no ``text/markdown`` representation gains one
+    that displays the first of its images from the file. The output's other
+    representations, such as ``text/plain`` or ``text/html``, are kept. The
+    files of each output's images are listed, by MIME type, in its
+    ``nbcollate_files`` metadata.
+
+    Images in Markdown cell attachments are written to the directory in the
+    same way. References to an attachment in the cell's source are replaced by
+    the path of its first image file, and the cell's ``nbcollate_files``
+    metadata lists the files of each attachment.
+
+    Args:
+        directory (str): the directory. It's created when the first payload
+            is written.
+        min_size (int): payloads smaller than this many bytes are left in
+            the notebook.
+        dry_run (bool): if true, files aren't written.
+    """
+
+    def __init__(self, directory, *, min_size=1024, dry_run=False):
+        self.directory = directory
+        self.min_size = min_size
+        self.dry_run = dry_run
+        self._paths = {}  # digest -> path
+
+    def _store(self, data, ext):
+        key = digest(data)
+        path = self._paths.get(key)
+        if path is None:
+            path = self._paths[key] = os.path.join(self.directory, key[:32] + ext)
+            if not self.dry_run and not os.path.exists(path):
+                os.makedirs(self.directory, exist_ok=True)
+                with open(path, 'wb') as f:
+                    f.write(data)
+        return path
+
+    def externalize(self, nb, notebook_path, *, stats=NULL_STATS):
+        """Replace the images in the outputs and attachments of ``nb`` by
+        references to files in the store.
+
+        Cells and outputs are replaced, rather than modified in place, so they
+        may be shared with other notebooks.
+
+        Args:
+            nb (Notebook): the notebook. This is modified in place.
+            notebook_path (str): where ``nb`` will be written. Links are
+                relative to its directory.
+            stats (CollationStats): the number of replaced payloads is
+                counted here.
+        """
+        base_dir = os.path.dirname(notebook_path)
+        nb.cells = [self._cell(cell, base_dir, stats) for cell in nb.cells]
+
+    def _cell(self, cell, base_dir, stats):
+        fields = {}
+        outputs = cell.get('outputs')
+        if outputs:
+            new_outputs = [self._output(output, base_dir, stats) for output in outputs]
+            if any(a is not b for a, b in zip(new_outputs, outputs)):
+                fields['outputs'] = new_outputs
+        attachments = cell.get('attachments')
+        if attachments:
+            source = cell.source
+            new_attachments = {}
+            files = {}
+            for name, bundle in attachments.items():
+                bundle, paths = self._bundle(bundle, base_dir, stats)
+                if paths:
+                    files[name] = paths
+                    path = next(iter(paths.values()))
+                    pattern = r'attachment:{}(?=[\s)"\']|$)'.format(re.escape(name))
+                    source = re.sub(pattern, lambda _: path, source)
+                if bundle:
+                    new_attachments[name] = bundle
+            if files:
+                metadata = cell.metadata.copy()
+                metadata[FILES_METADATA_KEY] = files
+                fields.update(source=source, metadata=metadata,
+                              attachments=nbformat.from_dict(new_attachments))
+        if not fields:
+            return cell
+        cell = replace_fields(cell, **fields)
+        if not cell.get('attachments', True):
+            del cell['attachments']
+        return cell
+
+    def _output(self, output, base_dir, stats):
+        data = output.get('data')
+        if not data:
+            return output
+        data, paths = self._bundle(data, base_dir, stats)
+        if not paths:
+            return output
+        # An output that has a Markdown representation already displays
+        # something in place of its images.
+        if 'text/markdown' not in data:
+            mime_type, path = next(iter(paths.items()))
+            data['text/markdown'] = '![{}]({})'.format(mime_type, path)
+        metadata = output.get('metadata', {}).copy()
+        metadata[FILES_METADATA_KEY] = paths
+        return replace_fields(output, data=nbformat.from_dict(data),
+                              metadata=nbformat.from_dict(metadata))
+
+    def _bundle(self, bundle, base_dir, stats):
+        """Write the images of ``min_size`` or more bytes in a MIME bundle to the store.
+
+        Returns:
+            (dict, dict): the bundle's other representations, and the path of
+            each written image relative to ``base_dir``, by MIME type.
+        """
+        rest = {}
+        paths = {}
+        for mime_type, value in bundle.items():
+            ext = BINARY_MIME_TYPES.get(mime_type) or TEXT_MIME_TYPES.get(mime_type)
+            if ext is not None:
+                payload = ''.join(value) if isinstance(value, list) else value
+                payload = (base64.b64decode(payload) if mime_type in BINARY_MIME_TYPES
+                           else payload.encode('utf-8'))
+                if len(payload) >= self.min_size:
+                    path = os.path.relpath(self._store(payload, ext), base_dir)
+                    paths[mime_type] = path.replace(os.sep, '/')
+                    stats.count('outputs_externalized')
+                    continue
+            rest[mime_type] = value
+        return rest, paths
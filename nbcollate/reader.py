@@ -0,0 +1,181 @@
+"""Read assignment and submission notebooks."""
+
+import json
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+
+import nbformat
+import nbformat.reader
+
+from .archive import read_bytes
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+CELL_TYPES = {'code', 'markdown', 'raw'}
+
+
+def _loads(data):
+    return orjson.loads(data) if orjson else json.loads(data)
+
+
+def is_collatable(nb_dict):
+    """Return true if ``nb_dict``, nbformat 4 notebook JSON, has the fields that
+    collation reads, with the types that it expects."""
+    if not isinstance(nb_dict, dict) or nb_dict.get('nbformat') != 4:
+        return False
+    cells = nb_dict.get('cells')
+    if not isinstance(nb_dict.get('metadata'), dict) or not isinstance(cells, list):
+        return False
+    for cell in cells:
+        if not (isinstance(cell, dict)
+                and cell.get('cell_type') in CELL_TYPES
+                and isinstance(cell.get('metadata'), dict)):
+            return False
+        source = cell.get('source')
+        if not (isinstance(source, str)
+                or isinstance(source, list)
+                and all(isinstance(s, str) for s in source)):
+            return False
+    return True
+
+
+def parse_notebook(data, *, outputs=True, validate=True):
+    """Parse a notebook from JSON text.
+
+    Args:
+        data (str or bytes): the notebook JSON
+        outputs (bool): if false, code cell outputs are discarded as soon as
+            the JSON is parsed, before the notebook is converted to
+            :class:`nbformat.NotebookNode` objects and validated. The time and
+            memory to read the notebook then depend on its sources, rather
+            than on the size of its outputs.
+        validate (bool): if false, the notebook isn't validated against the
+            nbformat schema. Only the fields that collation reads are checked,
+            and the JSON is parsed with ``orjson`` if it is installed. A
+            notebook that fails these checks, or that has an older format, is
+            read with validation instead.
+
+    Returns:
+        Notebook
+    """
+    if not validate:
+        try:
+            nb_dict = _loads(data)
+        except ValueError:
+            nb_dict = None
+        if is_collatable(nb_dict):
+            if not outputs:
+                for cell in nb_dict['cells']:
+                    if 'outputs' in cell:
+                        cell['outputs'] = []
+            return nbformat.versions[4].to_notebook_json(nb_dict)
+    if outputs:
+        return nbformat.reads(data, as_version=4)
+    nb_dict = nbformat.reader.parse_json(data)
+    if nb_dict.get('nbformat') != 4:
+        nb = nbformat.reads(data, as_version=4)
+        for cell in nb.cells:
+            if 'outputs' in cell:
+                cell.outputs = []
+        return nb
+    for cell in nb_dict.get('cells', ()):
+        if 'outputs' in cell:
+            cell['outputs'] = []
+    major, minor = nbformat.reader.get_version(nb_dict)
+    nb = nbformat.versions[major].to_notebook_json(nb_dict, minor=minor)
+    nb = nbformat.convert(nb, 4)
+    try:
+        nbformat.validate(nb)
+    except nbformat.ValidationError as e:
+        nbformat.get_logger().error("Notebook JSON is invalid: %s", e)
+    return nb
+
+
+def read_notebook(path, *, outputs=True, validate=True):
+    """Read a notebook from ``path``. Return None if the file isn't a notebook.
+
+    Args:
+        path (str): a notebook file pathname, or the path of a notebook in
+            an archive; see :mod:`nbcollate.archive`.
+        outputs (bool): if false, outputs are discarded; see :func:`parse_notebook`.
+        validate (bool): if false, the notebook is only partly validated; see
+            :func:`parse_notebook`.
+
+    Returns:
+        Notebook, or None.
+    """
+    try:
+        return parse_notebook(read_bytes(path), outputs=outputs, validate=validate)
+    except nbformat.reader.NotJSONError:
+        return None
+
+
+def safe_read(nbf, *, outputs=True, validate=True):
+    """A wrapper for nbformat.read, that prints a warning and returns None on
+    bad notebooks.
+    """
+    nb = read_notebook(nbf, outputs=outputs, validate=validate)
+    if nb is None:
+        print('while reading', nbf)
+    return nb
+
+
+def iter_notebooks(paths, *, jobs=1, outputs=True, validate=True):
+    """Generate notebooks read from ``paths``, optionally in parallel.
+
+    Files are parsed and validated in up to ``jobs`` worker processes. The
+    notebooks are generated in the same order as ``paths``; a file that can't
+    be read is reported as by :func:`safe_read`, and is generated as None.
+    Only a few notebooks are read ahead of the consumer, so that memory use
+    doesn't grow with the number of files.
+
+    Args:
+        paths ([str]): notebook file pathnames
+        jobs (int): the number of worker processes. 1 reads the files in this
+            process; None or 0 uses one process per CPU.
+        outputs (bool): if false, outputs are discarded; see :func:`parse_notebook`.
+        validate (bool): if false, notebooks are only partly validated; see
+            :func:`parse_notebook`.
+
+    Yields:
+        Notebook or None
+    """
+    paths = list(paths)
+    jobs = jobs or os.cpu_count() or 1
+    jobs = min(jobs, len(paths))
+    if jobs <= 1:
+        for path in paths:
+            yield safe_read(path, outputs=outputs, validate=validate)
+        return
+    read = partial(read_notebook, outputs=outputs, validate=validate)
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        pending = deque()
+        for path in paths:
+            pending.append((path, executor.submit(read, path)))
+            if len(pending) > 2 * jobs:
+                yield _report_unreadable(*pending.popleft())
+        while pending:
+            yield _report_unreadable(*pending.popleft())
+
+
+def _report_unreadable(path, future):
+    nb = future.result()
+    if nb is None:
+        print('while reading', path)
+    return nb
+
+
+def read_notebooks(paths, *, jobs=1, outputs=True, validate=True):
+    """Read a list of notebooks, optionally in parallel.
+
+    This is a list-valued version of :func:`iter_notebooks`.
+
+    Returns:
+        [Notebook or None]
+    """
+    return list(iter_notebooks(paths, jobs=jobs, outputs=outputs, validate=validate))
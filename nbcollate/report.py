@@ -0,0 +1,105 @@
+"""A students × prompts report of the answers in a collation."""
+
+import csv
+import json
+import re
+
+from .nbcollate import HEADER_RE
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+class CompletionMatrix(object):
+    """The number of answer cells that each submission has for each prompt.
+
+    A prompt is a section of the assignment notebook. Answer cells are counted
+    in the section of the assignment cell that they follow. Cells before the
+    first section aren't counted.
+
+    Attributes:
+        students (list): a row name for each submission
+        prompts ([str]): the section titles
+        counts: a ``len(students)`` × ``len(prompts)`` array of answer cell
+            counts. This is a NumPy integer array if NumPy is installed, and
+            otherwise a list of lists.
+    """
+
+    def __init__(self, students, prompts, counts):
+        self.students = students
+        self.prompts = prompts
+        self.counts = counts
+
+    @classmethod
+    def from_collator(cls, collator, *, students=None, header=None):
+        """Compute the matrix from the answers added to a :class:`NotebookCollator`.
+
+        The answers are counted as they were extracted, so the collated
+        notebook doesn't need to be assembled or re-read.
+
+        Args:
+            collator (NotebookCollator): the collator
+            students (list): the row names. These default to each submission's
+                id, or its label if its id is None.
+            header (str): a regular expression that matches section headers.
+        """
+        match = re.compile(header or HEADER_RE).match
+        prompts = []
+        # columns[k] is the column of the answers that precede assignment cell k
+        columns = [None]
+        for cell in collator.index.nb.cells:
+            m = match(cell.source)
+            if m:
+                prompts.append(m.group(1))
+            columns.append(len(prompts) - 1 if prompts else None)
+        entries = collator._entries
+        if students is None:
+            students = [id if id is not None else label for id, label, _ in entries]
+        assert len(students) == len(entries)
+        cells = [(row, columns[k], len(answer_cells))
+                 for row, (_, _, runs) in enumerate(entries)
+                 for k, answer_cells in runs
+                 if answer_cells and columns[k] is not None]
+        if np is not None:
+            counts = np.zeros((len(students), len(prompts)), dtype=np.int32)
+            if cells:
+                rows, cols, values = map(np.array, zip(*cells))
+                np.add.at(counts, (rows, cols), values)
+        else:
+            counts = [[0] * len(prompts) for _ in students]
+            for row, col, n in cells:
+                counts[row][col] += n
+        return cls(list(students), prompts, counts)
+
+    def completed(self):
+        """Return a boolean matrix of the prompts that each submission answered."""
+        if np is not None:
+            return self.counts > 0
+        return [[n > 0 for n in row] for row in self.counts]
+
+    def rows(self):
+        """Return the counts as a list of lists."""
+        return self.counts.tolist() if np is not None else self.counts
+
+    def as_dict(self):
+        """Return the matrix as a JSON-serializable dict."""
+        return {'students': self.students, 'prompts': self.prompts,
+                'counts': self.rows()}
+
+    def write_csv(self, f):
+        """Write the matrix to a text file as CSV, with a row per submission."""
+        writer = csv.writer(f)
+        writer.writerow(['student'] + self.prompts)
+        for student, row in zip(self.students, self.rows()):
+            writer.writerow([student] + row)
+
+    def write(self, path):
+        """Write the matrix to ``path``, as CSV if it ends in ``.csv``, else as JSON."""
+        with open(path, 'w', newline='') as f:
+            if path.endswith('.csv'):
+                self.write_csv(f)
+            else:
+                json.dump(self.as_dict(), f, indent=2)
+                f.write('\n')
@@ -0,0 +1,227 @@
+"""Serve collations over HTTP on localhost, keeping assignment indexes in memory.
+
+The server holds a :class:`NotebookCollator` for each assignment, so that an
+assignment is parsed and indexed once, and each submission is diffed once,
+when it arrives. Requests and responses are notebook or JSON documents:
+
+``PUT /assignments/NAME``
+    Add or replace an assignment. The body is the assignment notebook.
+``PUT /assignments/NAME/submissions/ID``
+    Add or replace a submission. The body is the submission notebook. An
+    optional ``label`` query parameter labels its answers.
+``DELETE /assignments/NAME/submissions/ID``
+    Remove a submission.
+``GET /assignments/NAME``
+    The collated notebook.
+``GET /stats``
+    Request counts, latencies, and collation statistics.
+"""
+
+import json
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, unquote, urlsplit
+
+import nbformat
+
+import nbcollate as nbc
+
+from .reader import is_collatable, parse_notebook
+from .stats import CollationStats
+
+ROUTES = [
+    ('GET', re.compile(r'^/stats$'), 'get_stats'),
+    ('GET', re.compile(r'^/assignments/([^/]+)$'), 'get_collated'),
+    ('PUT', re.compile(r'^/assignments/([^/]+)$'), 'put_assignment'),
+    ('PUT', re.compile(r'^/assignments/([^/]+)/submissions/([^/]+)$'),
+     'put_submission'),
+    ('DELETE', re.compile(r'^/assignments/([^/]+)/submissions/([^/]+)$'),
+     'delete_submission'),
+]
+
+
+class RequestError(Exception):
+    """An error that is reported to the client with an HTTP status."""
+
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+class CollationServer(ThreadingHTTPServer):
+    """An HTTP server that maintains the collations of a set of assignments.
+
+    Requests are handled in threads, but collation state is updated under a
+    single lock, since collation is CPU-bound.
+
+    Args:
+        address ((str, int)): the host and port. Port 0 picks a free port.
+        label (bool): if true, label answers by submission: with the
+            ``label`` query parameter, or else the submission id.
+        clear_outputs (bool): if true, cell output is cleared
+        validate (bool): if false, submissions aren't validated; see
+            :func:`parse_notebook`.
+        similarity (float): see :class:`AssignmentIndex`
+        verbose (bool): if true, log each request to stderr
+    """
+
+    def __init__(self, address=('127.0.0.1', 0), *, label=False, clear_outputs=False,
+                 validate=True, similarity=None, verbose=False):
+        super().__init__(address, CollationRequestHandler)
+        self.label = label
+        self.clear_outputs = clear_outputs
+        self.validate = validate
+        self.similarity = similarity
+        self.verbose = verbose
+        self.collators = {}  # assignment name -> NotebookCollator
+        self.stats = CollationStats()
+        self.lock = threading.Lock()
+        self.started = time.perf_counter()
+
+    @property
+    def url(self):
+        """The server's base URL."""
+        host, port = self.server_address[:2]
+        return 'http://{}:{}'.format(host, port)
+
+    def _collator(self, name):
+        collator = self.collators.get(name)
+        if collator is None:
+            raise RequestError(404, 'no assignment named {!r}'.format(name))
+        return collator
+
+    def _parse(self, body):
+        # nbformat reports JSON that isn't a notebook with any of these,
+        # depending on how the JSON differs from a notebook.
+        try:
+            nb = parse_notebook(body, outputs=not self.clear_outputs,
+                                validate=self.validate)
+        except (ValueError, KeyError, TypeError, AttributeError,
+                nbformat.ValidationError) as e:
+            raise RequestError(400, 'not a notebook: {}'.format(e))
+        # Without outputs, validation errors are logged rather than raised.
+        if not is_collatable(nb):
+            raise RequestError(400, 'not a notebook: missing or malformed cells')
+        return nb
+
+    def put_assignment(self, body, name):
+        """Add or replace an assignment. Its submissions are discarded."""
+        self.collators[name] = nbc.NotebookCollator(
+            self._parse(body), clear_outputs=self.clear_outputs,
+            similarity=self.similarity, stats=self.stats)
+        return {'assignment': name}
+
+    def put_submission(self, body, name, id, label=None):
+        """Add or replace a submission to assignment ``name``."""
+        collator = self._collator(name)
+        nb = self._parse(body)
+        if self.label and label is None:
+            label = id
+        collator.discard(id)
+        collator.add(id, nb, label=label if self.label else None)
+        return {'assignment': name, 'submission': id, 'submissions': len(collator)}
+
+    def delete_submission(self, body, name, id):
+        """Remove a submission from assignment ``name``."""
+        collator = self._collator(name)
+        collator.discard(id)
+        return {'assignment': name, 'submissions': len(collator)}
+
+    def get_collated(self, body, name):
+        """Return the collated notebook of assignment ``name``."""
+        collator = self._collator(name)
+        nb = collator.finish()
+        if not self.label:
+            nbc.remove_duplicate_answers(nb, sections=collator.section_index(nb))
+        return nb
+
+    def get_stats(self, body):
+        """Return the request counters and collation statistics."""
+        uptime = time.perf_counter() - self.started
+        data = self.stats.as_dict()
+        requests = sum(n for key, n in data['counts'].items()
+                       if key.startswith('requests.'))
+        data.update({
+            'uptime': uptime,
+            'requests_per_second': requests / uptime if uptime else None,
+            'assignments': {name: len(collator)
+                            for name, collator in self.collators.items()},
+        })
+        return data
+
+
+class CollationRequestHandler(BaseHTTPRequestHandler):
+    """Dispatch a request to the :class:`CollationServer` method for its route."""
+
+    server_version = 'nbcollate/' + nbc.__version__
+
+    def do_GET(self):
+        self._handle()
+
+    def do_PUT(self):
+        self._handle()
+
+    def do_DELETE(self):
+        self._handle()
+
+    def _handle(self):
+        server = self.server
+        url = urlsplit(self.path)
+        try:
+            body = self._read_body()
+            action, args = self._route(url.path)
+            kwargs = {}
+            label = parse_qs(url.query).get('label')
+            if action == 'put_submission' and label:
+                kwargs['label'] = label[0]
+            with server.lock, server.stats.stage('requests.' + action):
+                server.stats.count('requests.' + action)
+                server.stats.count('bytes_received', len(body))
+                result = getattr(server, action)(body, *args, **kwargs)
+                if isinstance(result, nbformat.NotebookNode):
+                    content = nbformat.writes(result)
+                else:
+                    content = json.dumps(result, indent=2)
+            self._respond(200, content)
+        except RequestError as e:
+            self._respond(e.status, json.dumps({'error': str(e)}))
+        except Exception as e:
+            # Respond, rather than leave the client waiting on the connection.
+            self.log_error('%s %s: %r', self.command, self.path, e)
+            self._respond(500, json.dumps({'error': '{}: {}'.format(
+                type(e).__name__, e)}))
+
+    def _read_body(self):
+        try:
+            length = int(self.headers.get('Content-Length') or 0)
+        except ValueError:
+            raise RequestError(400, 'invalid Content-Length')
+        return self.rfile.read(length) if length > 0 else b''
+
+    def _route(self, path):
+        methods = set()
+        for method, pattern, action in ROUTES:
+            m = pattern.match(path)
+            if m:
+                if method == self.command:
+                    return action, [unquote(group) for group in m.groups()]
+                methods.add(method)
+        if methods:
+            raise RequestError(405, 'use {}'.format(' or '.join(sorted(methods))))
+        raise RequestError(404, 'no such resource: {}'.format(path))
+
+    def _respond(self, status, content):
+        data = content.encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+        with self.server.lock:
+            self.server.stats.count('bytes_sent', len(data))
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
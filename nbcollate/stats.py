@@ -0,0 +1,95 @@
+"""Timings and counts of the stages of a collation."""
+
+import json
+import sys
+import time
+from collections import Counter, OrderedDict
+from contextlib import contextmanager
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+
+def peak_memory():
+    """Return the peak resident memory of this process in bytes, or None if unknown."""
+    if resource is None:
+        return None
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS, and in kilobytes elsewhere.
+    return maxrss if sys.platform == 'darwin' else maxrss * 1024
+
+
+_END = object()
+
+
+class CollationStats(object):
+    """Accumulate the time spent in each stage of a collation, and event counts.
+
+    Pass an instance to :func:`nbcollate` or :class:`NotebookCollator` to
+    record the stages of a collation. Stages that are entered repeatedly, such
+    as ``diff`` for each answer notebook, accumulate their time.
+
+    Args:
+        callback: if supplied, this is called with the stage name and its
+            duration in seconds, each time a stage is exited.
+    """
+
+    def __init__(self, callback=None):
+        self.callback = callback
+        self.seconds = OrderedDict()
+        self.counts = Counter()
+
+    @contextmanager
+    def stage(self, name):
+        """A context manager that adds the time spent in its body to stage ``name``."""
+        start = time.perf_counter()
+        try:
+            yield self
+        finally:
+            seconds = time.perf_counter() - start
+            self.seconds[name] = self.seconds.get(name, 0) + seconds
+            if self.callback:
+                self.callback(name, seconds)
+
+    def iter_stage(self, name, iterable):
+        """Generate the items of ``iterable``, adding the time spent computing
+        them to stage ``name``."""
+        items = iter(iterable)
+        while True:
+            with self.stage(name):
+                item = next(items, _END)
+            if item is _END:
+                return
+            yield item
+
+    def count(self, name, n=1):
+        """Add ``n`` to the count ``name``."""
+        self.counts[name] += n
+
+    def as_dict(self):
+        """Return the statistics as a JSON-serializable dict."""
+        return {
+            'seconds': dict(self.seconds),
+            'counts': dict(self.counts),
+            'peak_memory': peak_memory(),
+        }
+
+    def to_json(self):
+        """Return the statistics as a JSON string."""
+        return json.dumps(self.as_dict(), indent=2)
+
+
+class _NullStats(CollationStats):
+    """A :class:`CollationStats` that doesn't record anything."""
+
+    @contextmanager
+    def stage(self, name):
+        yield self
+
+    def count(self, name, n=1):
+        pass
+
+
+NULL_STATS = _NullStats()
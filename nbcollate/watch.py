@@ -0,0 +1,143 @@
+"""Re-collate an assignment as its submission files change."""
+
+import os
+import time
+
+import nbcollate as nbc
+
+from .archive import split_archive_path
+from .cli import expand_paths, iter_answers, submission_labels
+from .reader import safe_read
+
+
+class CollationWatcher(object):
+    """Maintain the collation of a set of submission files.
+
+    Each call to :meth:`poll` re-reads only the submission files that were
+    added or modified since the previous call, and combines their answers
+    with the answers that were already extracted from the other files. A
+    directory in ``submission_paths`` stands for the notebooks that it
+    contains at the time of each poll. A file that is removed or replaced
+    while it's read is treated as removed, until the next poll.
+
+    Args:
+        master_nb_path (str): the assignment notebook
+        submission_paths ([str]): submission notebook files and directories
+        label (bool): if true, label answers by notebook
+        clear_outputs (bool): if true, cell output is cleared
+        similarity (float): if set, match edited prompt cells approximately
+        jobs (int): the number of processes that read changed files; see
+            :func:`iter_notebooks`.
+        cache (AnswerCache): if supplied, answers are cached here
+        validate (bool): if false, submissions aren't validated; see
+            :func:`parse_notebook`.
+        stats (CollationStats): if supplied, read and diff timings are
+            recorded here.
+        exclude ([str]): files to ignore, such as the collated notebook
+    """
+
+    def __init__(self, master_nb_path, submission_paths, *, label=False,
+                 clear_outputs=False, similarity=None, jobs=1, cache=None,
+                 validate=True, stats=None, exclude=()):
+        master_nb = safe_read(master_nb_path)
+        assert master_nb
+        self.collator = nbc.NotebookCollator(master_nb, clear_outputs=clear_outputs,
+                                             similarity=similarity, stats=stats)
+        self.submission_paths = submission_paths
+        self.label = label
+        self.jobs = jobs
+        self.cache = cache
+        self.validate = validate
+        self.exclude = [master_nb_path] + list(exclude)
+        self.paths = []
+        self.answers = {}  # path -> answers extracted by the collator
+        self.signatures = {}  # path -> (mtime, size) when the file was read
+
+    def poll(self):
+        """Read the submission files that changed since the last call.
+
+        Returns:
+            bool: true if the set of answers changed.
+        """
+        paths = self.paths = expand_paths(self.submission_paths, exclude=self.exclude)
+        changed_paths = []
+        for path in paths:
+            try:
+                # A notebook in an archive is re-read when the archive changes.
+                stat = os.stat(split_archive_path(path)[0])
+            except OSError:
+                continue
+            signature = (stat.st_mtime_ns, stat.st_size)
+            if self.signatures.get(path) != signature:
+                self.signatures[path] = signature
+                changed_paths.append(path)
+        answers = self._iter_answers(changed_paths)
+        for i, path in enumerate(changed_paths):
+            try:
+                path_answers = next(answers)
+            except OSError:
+                # The file was removed or replaced since it was listed. Forget
+                # it, so that it's read again if it's still there at the next
+                # poll, and read the remaining files afresh.
+                del self.signatures[path]
+                path_answers = None
+                answers = self._iter_answers(changed_paths[i + 1:])
+            if path_answers is not None:
+                self.answers[path] = path_answers
+            else:
+                self.answers.pop(path, None)
+        changed = bool(changed_paths)
+        for path in set(self.signatures) - set(paths):
+            del self.signatures[path]
+            self.answers.pop(path, None)
+            changed = True
+        return changed
+
+    def _iter_answers(self, paths):
+        return iter_answers(self.collator, paths, jobs=self.jobs, cache=self.cache,
+                            validate=self.validate)
+
+    def submissions(self):
+        """Return the paths of the submissions that have answers, in order."""
+        return [path for path in self.paths if path in self.answers]
+
+    def make_collator(self, *, ids=False, stats=None):
+        """Return a :class:`NotebookCollator` with the answers read so far.
+
+        Args:
+            ids (bool): if true, the submission paths are used as the ids of
+                their answers.
+            stats (CollationStats): the collator's statistics
+        """
+        paths = self.submissions()
+        labels = [None] * len(paths)
+        if self.label and paths:
+            labels = submission_labels(paths)
+        collator = nbc.NotebookCollator(self.collator.index,
+                                        clear_outputs=self.collator.clear_outputs,
+                                        stats=stats)
+        for path, label in zip(paths, labels):
+            collator.add_answers(path if ids else None, self.answers[path],
+                                 label=label)
+        return collator
+
+    def collated_nb(self):
+        """Return the collated notebook, from the answers read so far."""
+        collator = self.make_collator()
+        nb = collator.finish()
+        if not self.label:
+            nbc.remove_duplicate_answers(nb, sections=collator.section_index(nb))
+        return nb
+
+    def run(self, on_change, *, interval=1.0):
+        """Call ``on_change()`` whenever the answers change.
+
+        This polls every ``interval`` seconds, until interrupted.
+        """
+        try:
+            while True:
+                if self.poll():
+                    on_change()
+                time.sleep(interval)
+        except KeyboardInterrupt:
+            pass
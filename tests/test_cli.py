@@ -0,0 +1,503 @@
+import asyncio
+import base64
+import csv
+import json
+import os
+import subprocess
+import sys
+import tarfile
+import threading
+import urllib.error
+import urllib.request
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+
+import nbformat
+import nbformat.v3
+import pytest
+
+from helpers import read_notebook
+from nbcollate import (AnswerCache, __version__, cli, nb_clear_outputs, nbcollate,
+                       nbcollate_async, read_notebooks, reader, remove_duplicate_answers)
+from nbcollate.cli import main
+from nbcollate.server import CollationServer
+
+FILES_DIR = os.path.join(os.path.dirname(__file__), 'files')
+ASSIGNMENT_PATH = os.path.join(FILES_DIR, 'assignment.ipynb')
+STUDENT_PATHS = [os.path.join(FILES_DIR, 'student-%d.ipynb' % i) for i in [1, 2, 3, 4]]
+
+
+def test_read_notebooks_in_parallel(tmpdir, capsys):
+    bad_path = str(tmpdir.join('bad.ipynb'))
+    with open(bad_path, 'w') as f:
+        f.write('not json')
+    paths = STUDENT_PATHS[:2] + [bad_path] + STUDENT_PATHS[2:]
+    nbs = read_notebooks(paths, jobs=2)
+    assert nbs[2] is None
+    assert [nb for nb in nbs if nb] == [read_notebook(path) for path in STUDENT_PATHS]
+    assert capsys.readouterr().out == 'while reading {}\n'.format(bad_path)
+
+
+def test_cli_jobs(tmpdir):
+    main(['--jobs', '2', '--out', str(tmpdir), ASSIGNMENT_PATH] + STUDENT_PATHS)
+    nb = nbformat.read(str(tmpdir.join('assignment-collated.ipynb')), as_version=4)
+    expected = nbcollate(read_notebook('assignment'),
+                         [read_notebook(path) for path in STUDENT_PATHS])
+    remove_duplicate_answers(expected)
+    assert [c.source for c in nb.cells] == [c.source for c in expected.cells]
+
+
+def test_cli_cache(tmpdir):
+    cache_dir = tmpdir.join('cache')
+    args = ['--force', '--out', str(tmpdir), '--cache', str(cache_dir), ASSIGNMENT_PATH]
+    main(args + STUDENT_PATHS)
+    output_path = str(tmpdir.join('assignment-collated.ipynb'))
+    with open(output_path) as f:
+        uncached = f.read()
+    assert len(cache_dir.listdir()) == len(STUDENT_PATHS)
+
+    main(args + STUDENT_PATHS)
+    with open(output_path) as f:
+        assert f.read() == uncached
+
+
+@pytest.mark.parametrize('first_trusted', [True, False])
+def test_cli_cache_trust_inputs(tmpdir, first_trusted):
+    # Answers that were read without validation aren't used by a run that
+    # validates its inputs, and vice versa
+    cache_dir = tmpdir.join('cache')
+    args = ['--force', '--out', str(tmpdir), '--cache', str(cache_dir), ASSIGNMENT_PATH]
+    trusted = ['--trust-inputs'] + args
+    main((trusted if first_trusted else args) + STUDENT_PATHS)
+    main((args if first_trusted else trusted) + STUDENT_PATHS)
+    assert len(cache_dir.listdir()) == 2 * len(STUDENT_PATHS)
+
+
+def test_collation_watcher(tmpdir):
+    from nbcollate.watch import CollationWatcher
+
+    submissions_dir = tmpdir.mkdir('submissions')
+    for path in STUDENT_PATHS[:2]:
+        submissions_dir.join(os.path.basename(path)).write(open(path).read())
+    watcher = CollationWatcher(ASSIGNMENT_PATH, [str(submissions_dir)])
+    assert watcher.poll()
+    assert not watcher.poll()
+
+    submissions_dir.join('student-3.ipynb').write(open(STUDENT_PATHS[2]).read())
+    submissions_dir.join('student-1.ipynb').remove()
+    assert watcher.poll()
+    expected = nbcollate(read_notebook('assignment'),
+                         [read_notebook('student-2'), read_notebook('student-3')])
+    remove_duplicate_answers(expected)
+    assert watcher.collated_nb() == expected
+
+
+@pytest.mark.parametrize('use_cache', [False, True])
+def test_collation_watcher_file_removed_while_read(tmpdir, monkeypatch, use_cache):
+    from nbcollate.watch import CollationWatcher
+
+    submissions_dir = tmpdir.mkdir('submissions')
+    for path in STUDENT_PATHS[:2]:
+        submissions_dir.join(os.path.basename(path)).write(open(path).read())
+    cache = AnswerCache(str(tmpdir.join('cache'))) if use_cache else None
+    watcher = CollationWatcher(ASSIGNMENT_PATH, [str(submissions_dir)], cache=cache)
+    removed = submissions_dir.join('student-1.ipynb')
+
+    # Remove a file after the watcher lists it, and before it's read
+    def iter_answers(collator, paths, **kwargs):
+        if removed.exists():
+            removed.remove()
+        return cli.iter_answers(collator, paths, **kwargs)
+
+    monkeypatch.setattr('nbcollate.watch.iter_answers', iter_answers)
+    assert watcher.poll()
+    assert watcher.submissions() == [str(submissions_dir.join('student-2.ipynb'))]
+    monkeypatch.undo()
+
+    # The file is read if it comes back
+    removed.write(open(STUDENT_PATHS[0]).read())
+    assert watcher.poll()
+    assert len(watcher.submissions()) == 2
+
+
+def test_cli_watch_options(tmpdir, monkeypatch):
+    from nbcollate.watch import CollationWatcher
+
+    submissions_dir = tmpdir.mkdir('submissions')
+    for path in STUDENT_PATHS[:2]:
+        submissions_dir.join(os.path.basename(path)).write(open(path).read())
+
+    # Add a submission, and stop after one re-collation
+    def run(watcher, on_change, **kwargs):
+        submissions_dir.join('student-3.ipynb').write(open(STUDENT_PATHS[2]).read())
+        assert watcher.poll()
+        on_change()
+
+    monkeypatch.setattr(CollationWatcher, 'run', run)
+    report_path = str(tmpdir.join('report.json'))
+    stats_path = str(tmpdir.join('stats.json'))
+    main(['--watch', '--out', str(tmpdir), '--report', report_path, '--stats', stats_path,
+          '--cluster-answers', '0.5', '--cache', str(tmpdir.join('cache')),
+          ASSIGNMENT_PATH, str(submissions_dir)])
+    with open(report_path) as f:
+        assert len(json.load(f)['students']) == 3
+    with open(stats_path) as f:
+        assert 'cluster' in json.load(f)['seconds']
+    nb = nbformat.read(str(tmpdir.join('assignment-collated.ipynb')), as_version=4)
+    assert any(c.source.endswith('similar answers*') for c in nb.cells)
+
+
+def test_cli_stats(tmpdir):
+    stats_path = str(tmpdir.join('stats.json'))
+    main(['--out', str(tmpdir), '--stats', stats_path, ASSIGNMENT_PATH] + STUDENT_PATHS)
+    with open(stats_path) as f:
+        stats = json.load(f)
+    assert set(stats['seconds']) == {'read', 'diff', 'copy', 'assemble', 'dedup', 'write'}
+    assert stats['counts']['submissions'] == len(STUDENT_PATHS)
+    assert stats['counts']['bytes_written'] == os.path.getsize(
+        str(tmpdir.join('assignment-collated.ipynb')))
+
+
+def test_cli_batch(tmpdir):
+    for name in ['day1', 'day2']:
+        tmpdir.join(name + '.ipynb').write(open(ASSIGNMENT_PATH).read())
+    manifest = {'assignments': [
+        {'assignment': 'day1.ipynb', 'submissions': os.path.join(FILES_DIR, 'student-*.ipynb')},
+        {'assignment': 'day2.ipynb', 'submissions': [STUDENT_PATHS[0]],
+         'output': 'day2-out.ipynb', 'label': True},
+    ]}
+    manifest_path = tmpdir.join('manifest.json')
+    manifest_path.write(json.dumps(manifest))
+    stats_path = str(tmpdir.join('stats.json'))
+    main(['--batch', str(manifest_path), '--jobs', '2', '--stats', stats_path])
+
+    nb = nbformat.read(str(tmpdir.join('day1-collated.ipynb')), as_version=4)
+    expected = nbcollate(read_notebook('assignment'),
+                         [read_notebook(path) for path in STUDENT_PATHS])
+    remove_duplicate_answers(expected)
+    assert [c.source for c in nb.cells] == [c.source for c in expected.cells]
+    assert tmpdir.join('day2-out.ipynb').exists()
+    with open(stats_path) as f:
+        results = json.load(f)
+    assert [result['submissions'] for result in results] == [4, 1]
+
+
+@pytest.mark.parametrize('name, manifest, message', [
+    ('manifest.json', '{"assignments": [{"assignment": "day1.ipynb"}]}',
+     'assignment 1 needs the fields "assignment" and "submissions"'),
+    ('manifest.json', '[]', 'expected a list of assignments'),
+    ('manifest.json', '{', 'Expecting property name'),
+    ('manifest.toml', '[[assignments]]\nassignment = "day1.ipynb"\n',
+     'TOML manifest requires Python 3.11'),
+])
+def test_cli_batch_invalid_manifest(tmpdir, capsys, monkeypatch, name, manifest,
+                                    message):
+    # Simulate Python < 3.11, which has no tomllib
+    monkeypatch.setitem(sys.modules, 'tomllib', None)
+    manifest_path = tmpdir.join(name)
+    manifest_path.write(manifest)
+    with pytest.raises(SystemExit) as excinfo:
+        main(['--batch', str(manifest_path)])
+    assert excinfo.value.code == 1
+    assert message in capsys.readouterr().err
+
+
+def test_read_notebook_without_outputs():
+    path = os.path.join(FILES_DIR, 'assignment-collated.ipynb')
+    nb = reader.read_notebook(path, outputs=False)
+    expected = reader.read_notebook(path)
+    assert any(cell.get('outputs') for cell in expected.cells)
+    nb_clear_outputs(expected)
+    assert nb == expected
+
+
+def test_cli_clear_outputs(tmpdir):
+    main(['--clear-outputs', '--out', str(tmpdir), ASSIGNMENT_PATH] + STUDENT_PATHS)
+    nb = nbformat.read(str(tmpdir.join('assignment-collated.ipynb')), as_version=4)
+    assert not any(cell.get('outputs') for cell in nb.cells)
+
+
+def test_parse_notebook_without_validation():
+    for path in STUDENT_PATHS:
+        with open(path) as f:
+            data = f.read()
+        assert reader.parse_notebook(data, validate=False) == reader.parse_notebook(data)
+
+    # Older formats fall back to nbformat's conversion
+    v3_nb = nbformat.v3.new_notebook(worksheets=[nbformat.v3.new_worksheet(
+        cells=[nbformat.v3.new_code_cell(input='print(1)')])])
+    nb = reader.parse_notebook(nbformat.v3.writes_json(v3_nb), validate=False)
+    assert nb.nbformat == 4
+    assert [c.source for c in nb.cells] == ['print(1)']
+
+
+def test_nbcollate_async(tmpdir):
+    bad_path = str(tmpdir.join('bad.ipynb'))
+    with open(bad_path, 'w') as f:
+        f.write('not json')
+    paths = STUDENT_PATHS[:2] + [bad_path] + STUDENT_PATHS[2:]
+    expected = nbcollate(read_notebook('assignment'),
+                         [read_notebook(path) for path in STUDENT_PATHS], ids=STUDENT_PATHS)
+    with ProcessPoolExecutor(2) as executor:
+        nb = asyncio.run(nbcollate_async(read_notebook('assignment'), paths,
+                                         ids=STUDENT_PATHS[:2] + [None] + STUDENT_PATHS[2:],
+                                         executor=executor, concurrency=2))
+    assert nb == expected
+
+
+def test_cli_split_sections(tmpdir):
+    main(['--out', str(tmpdir), '--split-sections', ASSIGNMENT_PATH] + STUDENT_PATHS)
+    expected = nbcollate(read_notebook('assignment'),
+                         [read_notebook(path) for path in STUDENT_PATHS])
+    remove_duplicate_answers(expected)
+
+    index_nb = nbformat.read(str(tmpdir.join('assignment-collated.ipynb')), as_version=4)
+    links = index_nb.cells[-1].source.splitlines()
+    assert links[0] == '- [Question 1](assignment-collated/01-question-1.ipynb)'
+    cells = index_nb.cells[:-1]
+    for link in links:
+        path = link[link.index('(') + 1:-1]
+        cells += nbformat.read(str(tmpdir.join(path)), as_version=4).cells
+    assert [c.source for c in cells] == [c.source for c in expected.cells]
+
+    # Section notebooks aren't replaced without --force
+    sections_dir = tmpdir.join('assignment-collated')
+    tmpdir.join('assignment-collated.ipynb').remove()
+    with pytest.raises(SystemExit) as excinfo:
+        main(['--out', str(tmpdir), '--split-sections', ASSIGNMENT_PATH] + STUDENT_PATHS)
+    assert excinfo.value.code == 1
+    assert not tmpdir.join('assignment-collated.ipynb').exists()
+
+    # Section notebooks from an earlier collation with more sections are removed
+    sections_dir.join('09-old-question.ipynb').write('{}')
+    sections_dir.join('notes.ipynb').write('{}')
+    main(['--force', '--out', str(tmpdir), '--split-sections', ASSIGNMENT_PATH]
+         + STUDENT_PATHS)
+    assert sorted(f.basename for f in sections_dir.listdir()) == sorted(
+        [os.path.basename(link[link.index('(') + 1:-1]) for link in links]
+        + ['notes.ipynb'])
+
+
+def test_cli_dedupe_outputs(tmpdir):
+    image = base64.b64encode(bytes(range(256)) * 8).decode()
+    svg = '<svg>{}</svg>'.format(' ' * 2048)
+    gif = 'R0lGODlhAQABAAAAACw='
+    paths = []
+    for i, path in enumerate(STUDENT_PATHS):
+        nb = read_notebook(path)
+        cell = nbformat.v4.new_code_cell('plot({})'.format(i), outputs=[
+            nbformat.v4.new_output('display_data', {
+                'image/png': image, 'image/svg+xml': '<svg/>', 'text/html': '<b>plot</b>',
+                'text/plain': 'plot'}),
+            nbformat.v4.new_output('display_data', {
+                'image/png': image, 'image/svg+xml': svg, 'text/markdown': '*plot*'})])
+        nb.cells.append(cell)
+        nb.cells.append(nbformat.v4.new_markdown_cell(
+            'see {} ![plot](attachment:plot.png) ![tiny](attachment:tiny.gif)'.format(i),
+            attachments={'plot.png': {'image/png': image}, 'tiny.gif': {'image/gif': gif}}))
+        paths.append(str(tmpdir.join('student-%d.ipynb' % i)))
+        nbformat.write(nb, paths[-1])
+    main(['--out', str(tmpdir), '--dedupe-outputs', ASSIGNMENT_PATH] + paths)
+
+    files_dir = tmpdir.join('assignment-collated_files')
+    png_path, svg_path = sorted('assignment-collated_files/' + f.basename
+                                for f in files_dir.listdir())
+    assert png_path.endswith('.png') and svg_path.endswith('.svg')
+    nb = nbformat.read(str(tmpdir.join('assignment-collated.ipynb')), as_version=4)
+    cells = [cell for cell in nb.cells if cell.source.startswith('plot(')]
+    assert len(cells) == len(paths)
+    for cell in cells:
+        # Only the image is replaced; the other representations are kept
+        output = cell.outputs[0]
+        assert output.data == {
+            'text/markdown': '![image/png]({})'.format(png_path),
+            'image/svg+xml': '<svg/>', 'text/html': '<b>plot</b>', 'text/plain': 'plot'}
+        assert output.metadata.nbcollate_files == {'image/png': png_path}
+        # Every image is replaced, and an existing Markdown representation is kept
+        output = cell.outputs[1]
+        assert output.data == {'text/markdown': '*plot*'}
+        assert output.metadata.nbcollate_files == {'image/png': png_path,
+                                                   'image/svg+xml': svg_path}
+    cells = [cell for cell in nb.cells if cell.source.startswith('see ')]
+    assert len(cells) == len(paths)
+    for i, cell in enumerate(cells):
+        # Small attachments are left in the cell
+        assert cell.source == 'see {} ![plot]({}) ![tiny](attachment:tiny.gif)'.format(
+            i, png_path)
+        assert cell.attachments == {'tiny.gif': {'image/gif': gif}}
+        assert cell.metadata.nbcollate_files == {'plot.png': {'image/png': png_path}}
+
+
+def test_cli_report(tmpdir):
+    report_path = str(tmpdir.join('report.csv'))
+    main(['--out', str(tmpdir), '--report', report_path, ASSIGNMENT_PATH] + STUDENT_PATHS)
+    with open(report_path) as f:
+        rows = list(csv.reader(f))
+    assert rows[0] == ['student', 'Question 1', 'Question 2', 'A Quick Poll']
+    assert [row[0] for row in rows[1:]] == STUDENT_PATHS
+
+
+def test_cli_archive(tmpdir):
+    zip_path = str(tmpdir.join('submissions.zip'))
+    with zipfile.ZipFile(zip_path, 'w') as zf:
+        for path in STUDENT_PATHS[:2]:
+            zf.write(path, 'submissions/' + os.path.basename(path))
+        zf.writestr('__MACOSX/submissions/._student-1.ipynb', b'')
+    tar_path = str(tmpdir.join('submissions.tar.gz'))
+    with tarfile.open(tar_path, 'w:gz') as tf:
+        for path in STUDENT_PATHS[2:]:
+            tf.add(path, 'submissions/' + os.path.basename(path))
+    main(['--out', str(tmpdir), '--label', ASSIGNMENT_PATH, zip_path, tar_path])
+
+    nb = nbformat.read(str(tmpdir.join('assignment-collated.ipynb')), as_version=4)
+    expected = nbcollate(read_notebook('assignment'),
+                         [read_notebook(path) for path in STUDENT_PATHS],
+                         labels=['Student 1', 'Student 2', 'Student 3', 'Student 4'])
+    assert [c.source for c in nb.cells] == [c.source for c in expected.cells]
+
+
+def test_cli_version_defers_imports():
+    code = ("import sys\n"
+            "from nbcollate.cli import main\n"
+            "main(['--version'])\n"
+            "print(' '.join(sorted({'nbformat', 'minimalkeys', 'asyncio'} & set(sys.modules))))")
+    out = subprocess.run([sys.executable, '-c', code], stdout=subprocess.PIPE, check=True,
+                         cwd=os.path.join(os.path.dirname(__file__), '..'))
+    assert out.stdout.decode().splitlines() == ['nbcollate version ' + __version__, '']
+
+
+def test_cli_cluster_answers(tmpdir):
+    main(['--out', str(tmpdir), '--cluster-answers', '0.5', ASSIGNMENT_PATH] + STUDENT_PATHS)
+    nb = nbformat.read(str(tmpdir.join('assignment-collated.ipynb')), as_version=4)
+    expected = nbcollate(read_notebook('assignment'),
+                         [read_notebook(path) for path in STUDENT_PATHS])
+    remove_duplicate_answers(expected)
+    assert len(nb.cells) < len(expected.cells)
+    assert any(c.source.endswith('similar answers*') for c in nb.cells)
+
+
+@contextmanager
+def running_server(**kwargs):
+    """Run a CollationServer in a thread. Yield a function that makes requests."""
+    server = CollationServer(**kwargs)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.start()
+
+    def request(method, path, data=None):
+        req = urllib.request.Request(server.url + path, data=data, method=method)
+        with urllib.request.urlopen(req, timeout=10) as response:
+            return response.read()
+
+    request.server = server
+    try:
+        yield request
+    finally:
+        server.shutdown()
+        server.server_close()
+        thread.join()
+
+
+def test_collation_server():
+    with running_server() as request:
+        request('PUT', '/assignments/day1', open(ASSIGNMENT_PATH, 'rb').read())
+        for i, path in enumerate(STUDENT_PATHS[:3]):
+            request('PUT', '/assignments/day1/submissions/s%d' % i,
+                    open(path, 'rb').read())
+        request('DELETE', '/assignments/day1/submissions/s0')
+        nb = nbformat.reads(request('GET', '/assignments/day1').decode(), as_version=4)
+        expected = nbcollate(read_notebook('assignment'),
+                             [read_notebook('student-2'), read_notebook('student-3')],
+                             ids=['s1', 's2'])
+        remove_duplicate_answers(expected)
+        assert nb == expected
+
+        with pytest.raises(urllib.error.HTTPError) as excinfo:
+            request('GET', '/assignments/day2')
+        assert excinfo.value.code == 404
+        with pytest.raises(urllib.error.HTTPError) as excinfo:
+            request('PUT', '/assignments/day1/submissions/s1', b'not json')
+        assert excinfo.value.code == 400
+
+        stats = json.loads(request('GET', '/stats').decode())
+        assert stats['assignments'] == {'day1': 2}
+        assert stats['counts']['requests.put_submission'] == 4
+        assert stats['counts']['submissions'] == 3
+        assert stats['seconds']['requests.get_collated'] > 0
+
+
+@pytest.mark.parametrize('options', [{}, {'clear_outputs': True, 'validate': False}])
+def test_collation_server_errors(options):
+    with running_server(**options) as request:
+        request('PUT', '/assignments/day1', open(ASSIGNMENT_PATH, 'rb').read())
+        for body in [b'[]', b'"x"', b'null', b'{}', b'{"nbformat": 4}',
+                     b'{"nbformat": 4, "nbformat_minor": 0, "metadata": {}}',
+                     b'{"nbformat": 4, "nbformat_minor": 0, "metadata": {}, '
+                     b'"cells": [1]}']:
+            for path in ['/assignments/day2', '/assignments/day1/submissions/s1']:
+                with pytest.raises(urllib.error.HTTPError) as excinfo:
+                    request('PUT', path, body)
+                assert excinfo.value.code == 400, body
+
+        def fail(body):
+            raise RuntimeError('failed')
+
+        request.server.get_stats = fail
+        with pytest.raises(urllib.error.HTTPError) as excinfo:
+            request('GET', '/stats')
+        assert excinfo.value.code == 500
+        assert json.loads(excinfo.value.read().decode()) == {
+            'error': 'RuntimeError: failed'}
+        # The server still responds
+        assert len(nbformat.reads(request('GET', '/assignments/day1').decode(),
+                                  as_version=4).cells) > 0
+
+
+def test_cli_serve_invalid_assignment(tmpdir, capsys, monkeypatch):
+    closed = []
+    monkeypatch.setattr(CollationServer, 'server_close',
+                        lambda self: closed.append(self) or self.socket.close())
+    assignment_path = tmpdir.join('day1.ipynb')
+    assignment_path.write('{}')
+    with pytest.raises(SystemExit) as excinfo:
+        main(['--serve', '0', str(assignment_path)])
+    assert excinfo.value.code == 1
+    assert '{}: not a notebook'.format(assignment_path) in capsys.readouterr().err
+    assert len(closed) == 1
+
+
+def test_cli_delta(tmpdir):
+    collated_path = str(tmpdir.join('assignment-collated.ipynb'))
+    delta_path = str(tmpdir.join('delta.json'))
+    main(['--out', str(tmpdir), '--delta', delta_path, ASSIGNMENT_PATH]
+         + STUDENT_PATHS[:2])
+    previous_path = str(tmpdir.join('previous.ipynb'))
+    tmpdir.join('previous.ipynb').write(open(collated_path).read())
+
+    main(['--out', str(tmpdir), '--delta', delta_path, ASSIGNMENT_PATH] + STUDENT_PATHS)
+    with open(delta_path) as f:
+        delta = json.load(f)
+    assert delta['sources'] == STUDENT_PATHS[2:]
+    inserted = [cell for _, _, cells in delta['cells'] for cell in cells]
+    assert len(inserted) < len(nbformat.read(collated_path, as_version=4).cells)
+
+    main(['--apply-delta', delta_path, previous_path])
+    assert open(previous_path).read() == open(collated_path).read()
+
+    mtime = os.path.getmtime(collated_path)
+    main(['--out', str(tmpdir), '--delta', delta_path, ASSIGNMENT_PATH] + STUDENT_PATHS)
+    with open(delta_path) as f:
+        assert json.load(f)['cells'] == []
+    assert os.path.getmtime(collated_path) == mtime
+
+    # The generated label and cluster cells are also the same on a rerun
+    for options in [['--label'], ['--cluster-answers', '0.3']]:
+        out_dir = tmpdir.mkdir(options[0].lstrip('-'))
+        collated_path = str(out_dir.join('assignment-collated.ipynb'))
+        args = ['--out', str(out_dir), '--delta', delta_path] + options
+        main(args + [ASSIGNMENT_PATH] + STUDENT_PATHS)
+        mtime = os.path.getmtime(collated_path)
+        main(args + [ASSIGNMENT_PATH] + STUDENT_PATHS)
+        with open(delta_path) as f:
+            assert json.load(f)['cells'] == []
+        assert os.path.getmtime(collated_path) == mtime
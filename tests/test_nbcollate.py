@@ -1,5 +1,12 @@
+import asyncio
+import copy
+import os
+import random
 from collections import OrderedDict
 
+import nbformat.v4
+import pytest
+
 import nbcollate as nbc
 from helpers import maybe_write_notebook, nb_sections, read_notebook, section_contains_string
 from nbcollate import get_answer_tuples, nb_clear_outputs, nbcollate
@@ -87,3 +94,310 @@ def test_report_missing_answers():
     assert ('Question 2', 'student-1') in answers
     assert ('Question 2', 'student-2') not in answers
     assert ('Question 2', 'student-3') in answers
+
+
+def test_assignment_index():
+    index = nbc.AssignmentIndex(ASSIGNMENT_NB)
+    for nb in SUBMISSION_NBS.values():
+        assert index.opcodes(nb) == nbc.NotebookMatcher(ASSIGNMENT_NB, nb).get_opcodes()
+    assert nbcollate(index, SUBMISSION_NBS) == nbcollate(ASSIGNMENT_NB, SUBMISSION_NBS)
+
+
+def test_notebook_collator():
+    collator = nbc.NotebookCollator(ASSIGNMENT_NB)
+    for student_name, nb in SUBMISSION_NBS.items():
+        collator.add(student_name, nb)
+    assert collator.finish() == nbcollate(ASSIGNMENT_NB, SUBMISSION_NBS)
+
+    collator.discard('student-2')
+    expected = OrderedDict(SUBMISSION_NBS)
+    del expected['student-2']
+    assert collator.finish() == nbcollate(ASSIGNMENT_NB, expected)
+
+
+def test_nbcollate_generator():
+    nb = nbcollate(ASSIGNMENT_NB, (nb for nb in SUBMISSION_NBS.values()))
+    assert nb == nbcollate(ASSIGNMENT_NB, list(SUBMISSION_NBS.values()))
+
+
+def test_remove_duplicate_answers_by_key():
+    nb = ASSIGNMENT_NB.copy()
+    header, prompt = ASSIGNMENT_NB.cells[1:3]
+    answer = prompt.copy()
+    answer.source = 'print( "Hello" )'
+    first, second, third = (answer.copy() for _ in range(3))
+    second.source = 'print(  "Hello" )\n'
+    third.source = 'Print("hello")'
+    nb.cells = [header, first, second, third]
+
+    nbc.remove_duplicate_answers(nb)
+    assert nb.cells == [header, first, second, third]
+    nbc.remove_duplicate_answers(nb, key='whitespace')
+    assert [id(c) for c in nb.cells] == [id(header), id(first), id(third)]
+    nbc.remove_duplicate_answers(nb, key='fuzzy')
+    assert [id(c) for c in nb.cells] == [id(header), id(first)]
+
+
+def test_nbcollate_cache(tmpdir):
+    cache = nbc.AnswerCache(str(tmpdir))
+    nb = nbcollate(ASSIGNMENT_NB, SUBMISSION_NBS, cache=cache)
+    assert len(tmpdir.listdir()) == len(SUBMISSION_NBS)
+    assert nbcollate(ASSIGNMENT_NB, SUBMISSION_NBS, cache=cache) == nb
+
+
+def test_answer_cache_eviction(tmpdir):
+    cache = nbc.AnswerCache(str(tmpdir), max_size=20)
+    cache.put('a', 'x' * 8)
+    cache.put('b', 'y' * 8)
+    assert 'a' in cache and 'b' in cache
+    cache.put('c', 'z' * 8)
+    assert 'a' not in cache
+    assert cache.get('c') == 'z' * 8
+
+
+def test_answer_cache_entry_removed_during_scan(tmpdir, monkeypatch):
+    cache = nbc.AnswerCache(str(tmpdir), max_size=20)
+    cache.put('a', 'x' * 8)
+    cache.put('b', 'y' * 8)
+    scandir = os.scandir
+
+    def scandir_then_remove(path):
+        # Another process evicts an entry after the directory is listed
+        entries = list(scandir(path))
+        os.remove(cache._path('a'))
+        return iter(entries)
+
+    monkeypatch.setattr(os, 'scandir', scandir_then_remove)
+    cache.put('c', 'z' * 8)
+    assert 'a' not in cache
+    assert cache.get('c') == 'z' * 8
+
+
+def test_nbcollate_stats():
+    stages = []
+    stats = nbc.CollationStats(callback=lambda stage, _: stages.append(stage))
+    nb = nbcollate(ASSIGNMENT_NB, SUBMISSION_NBS, stats=stats)
+    assert stages.count('diff') == len(SUBMISSION_NBS)
+    assert stats.counts['cells_diffed'] == sum(len(nb.cells) for nb in SUBMISSION_NBS.values())
+    assert stats.counts['cells_output'] == len(nb.cells)
+
+
+def test_nbcollate_copy_cells():
+    inputs = copy.deepcopy(list(SUBMISSION_NBS.values()))
+    nb = nbcollate(ASSIGNMENT_NB, SUBMISSION_NBS, clear_outputs=True, copy_cells=False)
+    assert list(SUBMISSION_NBS.values()) == inputs
+    assert nb == nbcollate(ASSIGNMENT_NB, SUBMISSION_NBS, clear_outputs=True)
+
+    shared = nbcollate(ASSIGNMENT_NB, SUBMISSION_NBS.values(), copy_cells=False)
+    assert shared.cells[0] is ASSIGNMENT_NB.cells[0]
+    copied = nbcollate(ASSIGNMENT_NB, SUBMISSION_NBS.values())
+    assert copied.cells[0] is not ASSIGNMENT_NB.cells[0]
+
+
+def test_section_index():
+    nb = nbcollate(ASSIGNMENT_NB, SUBMISSION_NBS)
+    expected = copy.deepcopy(nb)
+    nbc.remove_duplicate_answers(expected)
+    nbc.sort_answers(expected)
+
+    cell_count = len(nb.cells)
+    sections = nbc.SectionIndex(nb)
+    matched = []
+    match = sections.header_match
+    sections.header_match = lambda source: matched.append(source) or match(source)
+    nbc.remove_duplicate_answers(nb, sections=sections)
+    nbc.sort_answers(nb, sections=sections)
+    assert get_answer_tuples(nb, sections=sections) == get_answer_tuples(expected)
+    assert nb.cells == expected.cells
+    # Each cell's source is matched against the header pattern only once
+    assert len(matched) == cell_count
+
+
+def test_nbcollate_similarity():
+    nb = ASSIGNMENT_NB.copy()
+    nb.cells = [cell.copy() for cell in ASSIGNMENT_NB.cells]
+    nb.cells[3].source = '## Question 2\n\nQuestion 2 text'
+    nb.cells[4].source = 'answer = 2'
+    sources = [cell.source for cell in nbcollate(ASSIGNMENT_NB, [nb]).cells]
+    assert nb.cells[3].source in sources
+
+    sources = [cell.source for cell in nbcollate(ASSIGNMENT_NB, [nb], similarity=0.8).cells]
+    assert nb.cells[3].source not in sources
+    assert sources.index('answer = 2') == sources.index(ASSIGNMENT_NB.cells[3].source) + 1
+
+    # A code cell isn't matched with a markdown cell
+    nb.cells[3] = nbformat.v4.new_code_cell(nb.cells[3].source)
+    sources = [cell.source for cell in nbcollate(ASSIGNMENT_NB, [nb], similarity=0.8).cells]
+    assert nb.cells[3].source in sources
+
+
+def test_minhash_index():
+    from nbcollate.fuzzy import MinHashIndex
+
+    # Enough strings of the same length that queries use the signature bands
+    strings = ['string {:04d} of a list of similar strings'.format(i)
+               for i in range(1000)]
+    index = MinHashIndex(strings, 0.8)
+    assert index.query(strings[123] + '.') == 123
+    assert index.query(strings[123], accept=lambda i: i != 123) != 123
+    assert index.query('an unrelated query string') is None
+
+
+def test_minhash_signature_numpy(monkeypatch):
+    pytest.importorskip('numpy')
+    from nbcollate import fuzzy
+
+    index = fuzzy.MinHashIndex([], 0.8)
+    shingle_sets = [fuzzy.shingles(s) for s in
+                    ['', 'x', 'total = sum(values) / len(values)', 'ünïcødé ' * 20]]
+    signatures = [index._signature(s) for s in shingle_sets]
+    # Without NumPy, each hash function is computed separately
+    monkeypatch.setattr(fuzzy, 'np', None)
+    assert [index._signature(s) for s in shingle_sets] == signatures
+
+
+def test_cluster_numpy(monkeypatch):
+    pytest.importorskip('numpy')
+    from nbcollate import fuzzy
+
+    rng = random.Random(0)
+    words = ['total', 'sum', 'values', 'len', 'print', 'mean', '=', '/', '(', ')']
+    strings = [' '.join(rng.choice(words) for _ in range(rng.randrange(1, 8)))
+               for _ in range(200)] + ['', 'x', 'x']
+    thresholds = [0, 0.3, 0.6, 0.9, 1]
+    shingle_sets = [fuzzy.shingles(s) for s in strings]
+    clusters = [fuzzy._cluster_matrix(shingle_sets, t) for t in thresholds]
+    # Without NumPy, cluster computes each similarity separately
+    monkeypatch.setattr(fuzzy, 'np', None)
+    assert clusters == [fuzzy.cluster(strings, t) for t in thresholds]
+    assert any(len(members) > 1 for members in clusters[2])
+
+
+def test_nbcollate_async():
+    nb = asyncio.run(nbc.nbcollate_async(ASSIGNMENT_NB, SUBMISSION_NBS, concurrency=1))
+    assert nb == nbcollate(ASSIGNMENT_NB, SUBMISSION_NBS)
+
+
+def test_nbcollate_async_iterable(monkeypatch):
+    from nbcollate import aio
+
+    done = []
+    extract_answers = aio._extract_answers
+
+    def counted_extract_answers(*args):
+        answers = extract_answers(*args)
+        done.append(answers)
+        return answers
+
+    monkeypatch.setattr(aio, '_extract_answers', counted_extract_answers)
+    answer_nbs = list(SUBMISSION_NBS.values()) * 5
+
+    def iter_answer_nbs():
+        for n, nb in enumerate(answer_nbs):
+            # The iterable is consumed as notebooks are started
+            assert n - len(done) <= 2
+            yield nb
+
+    nb = asyncio.run(nbc.nbcollate_async(ASSIGNMENT_NB, iter_answer_nbs(),
+                                         concurrency=2))
+    assert nb == nbcollate(ASSIGNMENT_NB, answer_nbs)
+
+
+def test_completion_matrix():
+    collator = nbc.NotebookCollator(ASSIGNMENT_NB)
+    for student_name, nb in SUBMISSION_NBS.items():
+        collator.add(student_name, nb)
+    matrix = collator.completion_matrix()
+    assert matrix.students == list(SUBMISSION_NBS)
+    assert matrix.prompts == ['Question 1', 'Question 2', 'A Quick Poll']
+    completed = {(title, student)
+                 for student, row in zip(matrix.students, matrix.completed())
+                 for title, answered in zip(matrix.prompts, row) if answered}
+    assert completed == get_answer_tuples(collator.finish())
+
+
+def test_completion_matrix_numpy(tmpdir, monkeypatch):
+    pytest.importorskip('numpy')
+    from nbcollate import report
+
+    collator = nbc.NotebookCollator(ASSIGNMENT_NB)
+    for student_name, nb in SUBMISSION_NBS.items():
+        collator.add(student_name, nb)
+    empty_collator = nbc.NotebookCollator(ASSIGNMENT_NB)
+
+    def exports(name):
+        matrix = collator.completion_matrix()
+        for ext in ['.csv', '.json']:
+            matrix.write(str(tmpdir.join(name + ext)))
+        return (matrix.rows(), [list(row) for row in matrix.completed()],
+                empty_collator.completion_matrix().rows())
+
+    expected = exports('numpy')
+    assert {n for row in expected[0] for n in row} == {0, 1}
+    # Without NumPy, the counts are a list of lists
+    monkeypatch.setattr(report, 'np', None)
+    assert exports('lists') == expected
+    for ext in ['.csv', '.json']:
+        assert tmpdir.join('lists' + ext).read() == tmpdir.join('numpy' + ext).read()
+
+
+def test_collator_section_index():
+    collator = nbc.NotebookCollator(ASSIGNMENT_NB)
+    for student_name, nb in SUBMISSION_NBS.items():
+        collator.add(student_name, nb)
+    nb = collator.finish()
+    expected = copy.deepcopy(nb)
+    nbc.remove_duplicate_answers(expected)
+
+    sections = collator.section_index(nb)
+    matched = []
+    sections.header_match = lambda source: matched.append(source)
+    nbc.remove_duplicate_answers(nb, sections=sections)
+    assert nb.cells == expected.cells
+    assert get_answer_tuples(nb, sections=sections) == get_answer_tuples(expected)
+    # The cell records from collation were reused, rather than recomputed
+    assert matched == []
+
+
+def test_sort_answers_with_similarity():
+    nb = ASSIGNMENT_NB.copy()
+    header, prompt = ASSIGNMENT_NB.cells[1:3]
+    sources = ['total = sum(values) / len(values)',
+               'print("hello, world")',
+               'total = sum(values)/len(values)',
+               'total = sum(values) / len(values)  # mean']
+    answers = [prompt.copy() for _ in sources]
+    for cell, source in zip(answers, sources):
+        cell.source = source
+    nb.cells = [header] + answers
+
+    nbc.sort_answers(nb, similarity=0.6)
+    assert [c.source for c in nb.cells] == [header.source, sources[1], sources[0],
+                                             '*2 similar answers*']
+    assert nb.cells[2].metadata.nbcollate_cluster_size == 3
+    assert 'nbcollate_cluster_size' not in answers[0].metadata
+
+
+def test_notebook_delta():
+    from nbcollate.delta import make_cell_ids_unique
+
+    # Give the cells nbformat 4.5 ids, that the submissions share
+    assignment_nb = copy.deepcopy(ASSIGNMENT_NB)
+    assignment_nb.nbformat_minor = 5
+    submission_nbs = copy.deepcopy(SUBMISSION_NBS)
+    for nb in [assignment_nb] + list(submission_nbs.values()):
+        for i, cell in enumerate(nb.cells):
+            cell.id = 'cell-%d' % i
+
+    first_two = OrderedDict(list(submission_nbs.items())[:2])
+    old = make_cell_ids_unique(nbcollate(assignment_nb, first_two))
+    new = make_cell_ids_unique(nbcollate(assignment_nb, submission_nbs))
+    assert new == make_cell_ids_unique(nbcollate(assignment_nb, submission_nbs))
+    assert len({cell.id for cell in new.cells}) == len(new.cells)
+
+    delta = nbc.notebook_delta(old, new)
+    assert delta['sources'] == ['student-3', 'student-4']
+    assert nbc.apply_delta(copy.deepcopy(old), delta) == new
+    assert nbc.notebook_delta(new, new)['cells'] == []
+    with pytest.raises(ValueError):
+        nbc.apply_delta(copy.deepcopy(new), delta)